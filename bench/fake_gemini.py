@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Substituto local do google.generativeai.GenerativeModel para benchmarks reprodutíveis.
+
+Configuração por variáveis de ambiente (lidas em install()):
+    FAKE_GEMINI_LATENCY       segundos até a resposta completa (padrão 1.0)
+    FAKE_GEMINI_JITTER        variação aleatória somada à latência, em segundos (padrão 0.0)
+    FAKE_GEMINI_CHUNKS        número de partes no modo streaming (padrão 8)
+    FAKE_GEMINI_BLOCK_RATE    fração de respostas bloqueadas por "segurança" (padrão 0.0)
+    FAKE_GEMINI_ERROR_RATE    fração de chamadas que falham com erro 500 (padrão 0.0)
+    FAKE_GEMINI_429_RATE      fração de chamadas que falham com limite de requisições (padrão 0.0)
+    FAKE_GEMINI_SEED          semente do gerador aleatório (padrão 42)
+"""
+import os
+import random
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+RECIPE_TEMPLATE = """# {title}
+
+## Ingredientes
+- 2 xícaras de farinha de trigo
+- 3 ovos
+- 1 xícara de leite
+- 1/2 xícara de açúcar
+- 1 colher (sopa) de fermento em pó
+- 1 pitada de sal
+
+## Modo de Preparo
+1. Preaqueça o forno a 180 °C e unte uma forma média.
+2. Bata os ovos com o açúcar até obter um creme claro.
+3. Acrescente o leite e a farinha aos poucos, mexendo sempre.
+4. Junte o fermento e o sal, misturando delicadamente.
+5. Despeje na forma e asse por cerca de 35 minutos.
+
+**Tempo de preparo total:** 50 minutos
+
+{filler}
+"""
+
+class FakeConfig:
+    def __init__(self):
+        self.latency = float(os.getenv("FAKE_GEMINI_LATENCY", "1.0"))
+        self.jitter = float(os.getenv("FAKE_GEMINI_JITTER", "0.0"))
+        self.chunks = max(1, int(os.getenv("FAKE_GEMINI_CHUNKS", "8")))
+        self.block_rate = float(os.getenv("FAKE_GEMINI_BLOCK_RATE", "0.0"))
+        self.error_rate = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0.0"))
+        self.rate_limit_rate = float(os.getenv("FAKE_GEMINI_429_RATE", "0.0"))
+        self.random = random.Random(int(os.getenv("FAKE_GEMINI_SEED", "42")))
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def roll(self):
+        with self.lock:
+            self.calls += 1
+            return self.random.random(), self.random.random()
+
+config = None
+
+def _response(text, blocked=False):
+    feedback = SimpleNamespace(block_reason="SAFETY" if blocked else None)
+    return SimpleNamespace(text=text, parts=[] if blocked else [text], prompt_feedback=feedback)
+
+class FakeStreamResponse:
+    """Iterável de partes, como a resposta de generate_content(stream=True)."""
+
+    def __init__(self, text, chunks, delay, blocked):
+        self._text = text
+        self._chunks = chunks
+        self._delay = delay
+        self.prompt_feedback = SimpleNamespace(block_reason="SAFETY" if blocked else None)
+        self._blocked = blocked
+
+    def __iter__(self):
+        if self._blocked:
+            time.sleep(self._delay * self._chunks)
+            yield _response("", blocked=True)
+            return
+        size = -(-len(self._text) // self._chunks)
+        for start in range(0, len(self._text), size):
+            time.sleep(self._delay)
+            yield _response(self._text[start:start + size])
+
+class FakeGenerativeModel:
+    def __init__(self, model_name="fake", **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        outcome, jitter_roll = config.roll()
+        latency = config.latency + config.jitter * jitter_roll
+        if outcome < config.error_rate:
+            time.sleep(latency)
+            raise google_exceptions.InternalServerError("Erro simulado do Gemini falso.")
+        outcome -= config.error_rate
+        if outcome < config.rate_limit_rate:
+            raise google_exceptions.ResourceExhausted("Limite simulado do Gemini falso.")
+        outcome -= config.rate_limit_rate
+        blocked = outcome < config.block_rate
+        title = f"Receita Falsa {zlib.crc32(prompt.encode()) % 10000}"
+        text = RECIPE_TEMPLATE.format(title=title, filler="Dica: sirva morno. " * 20)
+        if stream:
+            return FakeStreamResponse(text, config.chunks, latency / config.chunks, blocked)
+        time.sleep(latency)
+        return _response("" if blocked else text, blocked=blocked)
+
+def install():
+    """Troca genai.GenerativeModel pelo modelo falso. Deve rodar antes de importar src.main."""
+    global config
+    config = FakeConfig()
+    os.environ.setdefault("GEMINI_API_KEY", "fake-benchmark-key")
+    genai.GenerativeModel = FakeGenerativeModel
+    return config
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""Benchmark reprodutível do app de receitas com um Gemini falso (bench/fake_gemini.py).
+
+Exemplos (a partir da raiz do repositório):
+    python -m bench.run_bench --mode testclient --catalog-sizes 0,1000,10000 --concurrency 1,8,32
+    python -m bench.run_bench --mode gunicorn --threads 8 --workers 2 --endpoints recipes,categories
+
+Cada cenário (modo x tamanho do catálogo x endpoint x concorrência) vira uma linha JSON em --output
+com req/s, latências p50/p95/p99 (ms), contagem de erros por status e RSS dos processos do servidor.
+Cada tamanho de catálogo roda num diretório de dados temporário próprio, semeado antes da medição.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("generate_recipe", "recipes", "categories", "generate_pdf")
+SEED_BASE_TIMESTAMP_MS = 1_600_000_000_000 # Bem no passado: não colide com IDs gerados durante a medição
+SEED_TEXT = """# {title}
+
+## Ingredientes
+- 2 xícaras de {a}
+- 1 xícara de {b}
+- 3 colheres (sopa) de {c}
+
+## Modo de Preparo
+1. Misture {a} com {b}.
+2. Acrescente {c} e cozinhe por {minutes} minutos.
+
+**Tempo de preparo total:** {minutes} minutos
+"""
+SEED_WORDS = ("frango", "arroz", "feijão", "tomate", "cebola", "alho", "batata", "cenoura", "queijo", "leite",
+              "ovos", "farinha", "açúcar", "chocolate", "limão", "abobrinha", "carne moída", "milho", "aveia", "banana")
+
+# --- Catálogo sintético ---
+def seed_catalog(main, size, seed=1234):
+    """Preenche o store com `size` receitas distribuídas pelas categorias/subcategorias conhecidas."""
+    rng = random.Random(seed)
+    buckets = [(cat, sub) for cat, subs in main.RECIPE_CATEGORIES.items() for sub in (subs or ["Geral"])]
+    batch = []
+    for i in range(size):
+        category, subcategory = buckets[i % len(buckets)]
+        a, b, c = rng.sample(SEED_WORDS, 3)
+        title = f"{a.capitalize()} com {b} e {c} #{i}"
+        batch.append(main.Recipe(
+            f"{category.replace(' ', '_')}_{subcategory.replace(' ', '_')}_{SEED_BASE_TIMESTAMP_MS + i}",
+            title, category, subcategory,
+            SEED_TEXT.format(title=title, a=a, b=b, c=c, minutes=rng.randint(10, 120)),
+        ))
+        if len(batch) == 1000:
+            main.recipes_db.add_many(batch)
+            batch = []
+    if batch:
+        main.recipes_db.add_many(batch)
+
+# --- Requisições ---
+class RequestFactory:
+    """Monta (método, caminho, corpo JSON) de cada endpoint, variando os parâmetros de forma determinística."""
+
+    def __init__(self, categories, seeded_ids, use_cache, pdf_recipes, seed=99):
+        self.categories = categories
+        self.seeded_ids = seeded_ids
+        self.use_cache = use_cache
+        self.pdf_recipes = pdf_recipes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def build(self, endpoint):
+        with self.lock:
+            self.counter += 1
+            n = self.counter
+            category = self.random.choice(list(self.categories))
+            sample = self.random.sample(self.seeded_ids, min(self.pdf_recipes, len(self.seeded_ids)))
+        if endpoint == "generate_recipe":
+            body = {"category": category, "ingredients": [f"ingrediente{n % 50}"], "use_cache": self.use_cache}
+            return "POST", "/generate_recipe", body
+        if endpoint == "recipes":
+            return "GET", "/recipes?limit=50&sort=-created_at&fields=id,title,category,subcategory,excerpt", None
+        if endpoint == "categories":
+            return "GET", "/categories", None
+        if endpoint == "generate_pdf":
+            if not sample:
+                return "GET", "/generate_pdf?" + urllib.parse.urlencode({"category": category}), None
+            # Seleções aleatórias de receitas: mede a renderização, não só o cache de PDFs prontos
+            return "GET", "/generate_pdf?" + urllib.parse.urlencode([("ids[]", recipe_id) for recipe_id in sample]), None
+        raise ValueError(f"Endpoint desconhecido: {endpoint}")
+
+class TestClientDriver:
+    """Dispara requisições pelo test client do Flask, um cliente autenticado por thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def _client(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.app.test_client()
+            client.post("/login", data={"username": "bench", "password": "bench"})
+            self.local.client = client
+        return client
+
+    def send(self, method, path, body):
+        response = self._client().open(path, method=method, json=body)
+        response.get_data() # Consome o corpo (inclusive respostas em streaming)
+        status = response.status_code
+        response.close()
+        return status
+
+class HttpDriver:
+    """Dispara requisições HTTP reais (keep-alive), uma conexão autenticada por thread."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+            conn.request("POST", "/login", body="username=bench&password=bench",
+                         headers={"Content-Type": "application/x-www-form-urlencoded"})
+            response = conn.getresponse()
+            response.read()
+            self.local.cookie = response.getheader("Set-Cookie", "").split(";", 1)[0]
+            self.local.conn = conn
+        return conn
+
+    def send(self, method, path, body):
+        for attempt in range(2):
+            conn = self._connection()
+            headers = {"Cookie": self.local.cookie}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers["Content-Type"] = "application/json"
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                # Conexão keep-alive encerrada pelo servidor: reconecta uma vez
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_scenario(driver, factory, endpoint, concurrency, total_requests):
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def one_request(_):
+        method, path, body = factory.build(endpoint)
+        started = time.perf_counter()
+        try:
+            status = driver.send(method, path, body)
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one_request, range(total_requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "wall_seconds": round(wall, 4),
+        "req_per_s": round(total_requests / wall, 2) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "statuses": dict(statuses),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith(("2", "3"))),
+    }
+
+# --- Memória dos processos ---
+def read_rss_kb(pid):
+    """RSS atual do processo em kB (Linux, via /proc). Retorna None onde /proc não existe."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def child_pids(parent_pid):
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent_pid:
+            pids.append(int(entry))
+    return pids
+
+def server_rss(master_pid):
+    """RSS do master do gunicorn e de cada worker (kB)."""
+    workers = {pid: read_rss_kb(pid) for pid in child_pids(master_pid)}
+    master = read_rss_kb(master_pid)
+    known = [value for value in [master, *workers.values()] if value is not None]
+    return {"rss_master_kb": master, "rss_workers_kb": sorted(v for v in workers.values() if v is not None),
+            "rss_total_kb": sum(known) if known else None}
+
+# --- Modos de execução ---
+def scenario_record(args, mode, catalog_size, endpoint, concurrency, result, memory):
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "mode": mode,
+        "store": args.store,
+        "catalog_size": catalog_size,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "gunicorn": {"workers": args.workers, "threads": args.threads} if mode == "gunicorn" else None,
+        "gemini_rpm": args.gemini_rpm,
+        "pool_size": args.pool_size,
+        "fake_gemini": {"latency": args.latency, "jitter": args.jitter, "chunks": args.chunks,
+                        "block_rate": args.block_rate, "error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate},
+        **result,
+        **memory,
+    }
+
+def fake_gemini_env(args):
+    return {
+        "FAKE_GEMINI_LATENCY": str(args.latency),
+        "FAKE_GEMINI_JITTER": str(args.jitter),
+        "FAKE_GEMINI_CHUNKS": str(args.chunks),
+        "FAKE_GEMINI_BLOCK_RATE": str(args.block_rate),
+        "FAKE_GEMINI_ERROR_RATE": str(args.error_rate),
+        "FAKE_GEMINI_429_RATE": str(args.rate_limit_rate),
+    }
+
+def import_app_with_fake_gemini():
+    from bench import fake_gemini
+    fake_gemini.install()
+    from src import main
+    return main
+
+def seeded_recipe_ids(main):
+    return [recipe.id for recipe in main.recipes_db.list_recipes()]
+
+def worker_testclient(args):
+    """Roda dentro de um subprocesso com APP_DATA_DIR próprio: semeia, mede e grava as linhas em --worker-output."""
+    main = import_app_with_fake_gemini()
+    seed_catalog(main, args.worker_catalog_size)
+    factory = RequestFactory(main.RECIPE_CATEGORIES, seeded_recipe_ids(main), args.use_cache, args.pdf_recipes)
+    driver = TestClientDriver(main.app)
+    with open(args.worker_output, "a", encoding="utf-8") as out:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                requests = args.requests_for(endpoint)
+                if args.warmup:
+                    run_scenario(driver, factory, endpoint, concurrency, min(args.warmup, requests))
+                result = run_scenario(driver, factory, endpoint, concurrency, requests)
+                memory = {"rss_kb": read_rss_kb(os.getpid()),
+                          "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+                out.write(json.dumps(scenario_record(args, "testclient", args.worker_catalog_size, endpoint, concurrency, result, memory),
+                                     ensure_ascii=False) + "\n")
+                out.flush()
+
+def worker_seed(args):
+    main = import_app_with_fake_gemini()
+    seed_catalog(main, args.worker_catalog_size)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_server(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn encerrou com código {process.returncode} antes de aceitar conexões.")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/login")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn não respondeu dentro do tempo limite.")
+
+def run_gunicorn_catalog(args, catalog_size, env, log_file, out):
+    subprocess.run([sys.executable, "-m", "bench.run_bench", "--worker-seed", "--worker-catalog-size", str(catalog_size)],
+                   cwd=REPO_ROOT, env=env, check=True, stdout=log_file, stderr=subprocess.STDOUT)
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--worker-class", "gthread", "--threads", str(args.threads),
+         "--workers", str(args.workers), "--bind", f"127.0.0.1:{port}", "--timeout", "300", "bench.wsgi_fake:app"],
+        cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    try:
+        wait_for_server(port, process)
+        with tempfile.TemporaryDirectory() as scratch:
+            # IDs semeados (para o PDF) e categorias: lidos do mesmo diretório de dados que o servidor usa
+            catalog_path = os.path.join(scratch, "catalog.json")
+            subprocess.run([sys.executable, "-m", "bench.run_bench", "--worker-list-ids", catalog_path],
+                           cwd=REPO_ROOT, env=env, check=True, stdout=log_file, stderr=subprocess.STDOUT)
+            with open(catalog_path, encoding="utf-8") as f:
+                catalog = json.load(f)
+        seeded_ids, categories = catalog["ids"], catalog["categories"]
+        factory = RequestFactory(categories, seeded_ids, args.use_cache, args.pdf_recipes)
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                driver = HttpDriver("127.0.0.1", port)
+                requests = args.requests_for(endpoint)
+                if args.warmup:
+                    run_scenario(driver, factory, endpoint, concurrency, min(args.warmup, requests))
+                result = run_scenario(driver, factory, endpoint, concurrency, requests)
+                record = scenario_record(args, "gunicorn", catalog_size, endpoint, concurrency, result, server_rss(process.pid))
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                print(summary_line(record))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def worker_list_ids(args):
+    main = import_app_with_fake_gemini()
+    with open(args.worker_list_ids, "w", encoding="utf-8") as f:
+        json.dump({"ids": seeded_recipe_ids(main), "categories": main.RECIPE_CATEGORIES}, f, ensure_ascii=False)
+
+def summary_line(record):
+    return (f"[{record['mode']}] catálogo={record['catalog_size']} {record['endpoint']} c={record['concurrency']}: "
+            f"{record['req_per_s']} req/s, p50={record['p50_ms']}ms p95={record['p95_ms']}ms p99={record['p99_ms']}ms, "
+            f"erros={record['errors']}")
+
+_git_commit = None
+
+def git_commit():
+    global _git_commit
+    if _git_commit is None:
+        try:
+            _git_commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                         capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            _git_commit = "desconhecido"
+    return _git_commit
+
+def run(args):
+    output_path = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    base_env = {**os.environ, **fake_gemini_env(args), "RECIPES_STORE": args.store, "GEMINI_API_KEY": "fake-benchmark-key",
+                "GEMINI_RPM": str(args.gemini_rpm), "GEMINI_BURST": str(max(1, int(args.gemini_rpm // 60))),
+                "RECIPE_POOL_SIZE": str(args.pool_size)}
+    base_env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))
+    for catalog_size in args.catalog_sizes:
+        data_dir = tempfile.mkdtemp(prefix=f"bench-{catalog_size}-")
+        env = {**base_env, "APP_DATA_DIR": data_dir}
+        log_path = os.path.join(data_dir, "server.log")
+        try:
+            with open(log_path, "w") as log_file, open(output_path, "a", encoding="utf-8") as out:
+                if args.mode == "gunicorn":
+                    run_gunicorn_catalog(args, catalog_size, env, log_file, out)
+                    continue
+                start = out.tell()
+                cmd = [sys.executable, "-m", "bench.run_bench", "--worker-catalog-size", str(catalog_size),
+                       "--worker-output", output_path, *args.passthrough]
+                # Um processo por catálogo: estado do app (store, caches, métricas) sempre limpo
+                subprocess.run(cmd, cwd=REPO_ROOT, env=env, check=True, stdout=log_file, stderr=subprocess.STDOUT)
+            with open(output_path, encoding="utf-8") as f:
+                f.seek(start)
+                for line in f:
+                    print(summary_line(json.loads(line)))
+        except subprocess.CalledProcessError:
+            print(f"Falha no cenário com catálogo={catalog_size}. Log do servidor: {log_path}", file=sys.stderr)
+            args.keep_data = True
+            raise
+        finally:
+            if not args.keep_data:
+                shutil.rmtree(data_dir, ignore_errors=True)
+    print(f"Resultados gravados em {output_path}")
+
+def csv_ints(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def csv_endpoints(value):
+    endpoints = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Endpoints desconhecidos: {', '.join(sorted(unknown))}")
+    return endpoints
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("testclient", "gunicorn"), default="testclient")
+    parser.add_argument("--store", choices=("sqlite", "memory"), default="sqlite",
+                        help="Backend do store (o modo gunicorn exige sqlite para enxergar o catálogo semeado).")
+    parser.add_argument("--endpoints", type=csv_endpoints, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=csv_ints, default=[1, 8, 32])
+    parser.add_argument("--catalog-sizes", type=csv_ints, default=[0, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=200, help="Requisições medidas por cenário.")
+    parser.add_argument("--generate-requests", type=int, default=None, help="Requisições por cenário de /generate_recipe.")
+    parser.add_argument("--pdf-requests", type=int, default=None, help="Requisições por cenário de /generate_pdf.")
+    parser.add_argument("--warmup", type=int, default=10, help="Requisições descartadas antes de cada medição.")
+    parser.add_argument("--pdf-recipes", type=int, default=20, help="Receitas sorteadas por PDF.")
+    parser.add_argument("--use-cache", action="store_true", help="Permite que /generate_recipe responda do cache.")
+    parser.add_argument("--workers", type=int, default=1, help="Workers do gunicorn.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads por worker do gunicorn.")
+    parser.add_argument("--latency", type=float, default=1.0, help="Latência do Gemini falso (s).")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--block-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rpm", type=float, default=600000,
+                        help="Cota do limitador do app (GEMINI_RPM); o padrão alto mede o app, não o limitador.")
+    parser.add_argument("--pool-size", type=int, default=0,
+                        help="RECIPE_POOL_SIZE do app; 0 (padrão) evita gerações em segundo plano durante a medição.")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "bench", "results.jsonl"))
+    parser.add_argument("--keep-data", action="store_true", help="Mantém os diretórios de dados temporários.")
+    # Uso interno: subprocessos criados pelo próprio runner
+    parser.add_argument("--worker-catalog-size", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-seed", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-list-ids", default=None, help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+    if args.mode == "gunicorn" and args.store != "sqlite":
+        build_parser().error("O modo gunicorn exige --store sqlite.")
+    per_endpoint = {"generate_recipe": args.generate_requests, "generate_pdf": args.pdf_requests}
+    args.requests_for = lambda endpoint: per_endpoint.get(endpoint) or args.requests
+    # Repassa as opções de medição ao subprocesso do modo testclient, sem --output/--catalog-sizes
+    skip = {"--output", "--catalog-sizes", "--mode"}
+    args.passthrough = []
+    it = iter(argv)
+    for item in it:
+        key = item.split("=", 1)[0]
+        if key in skip:
+            if "=" not in item:
+                next(it, None)
+            continue
+        args.passthrough.append(item)
+
+    if args.worker_seed:
+        worker_seed(args)
+    elif args.worker_list_ids:
+        worker_list_ids(args)
+    elif args.worker_output:
+        worker_testclient(args)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
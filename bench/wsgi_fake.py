@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Entrada WSGI para o gunicorn com o Gemini falso: gunicorn bench.wsgi_fake:app"""
+from bench import fake_gemini
+
+fake_gemini.install()
+
+from src.main import app # noqa: E402 (precisa vir depois da troca do modelo)
@@ -1,16 +1,86 @@
 # -*- coding: utf-8 -*-
+import time
+MODULE_IMPORT_STARTED = time.perf_counter() # Início da importação do app (relatório no final do arquivo)
 import os
-import google.generativeai as genai
-from flask import Flask, request, jsonify, render_template_string, Response, make_response
+from flask import Flask, g, request, jsonify, Response, send_file, stream_with_context, url_for
+from werkzeug.datastructures import MultiDict
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import re # Para extrair título
-from weasyprint import HTML, CSS # Para gerar PDF
+try:
+    import brotli # Opcional: versão brotli das páginas pré-compiladas
+except ImportError:
+    brotli = None
+try:
+    import fcntl # Opcional (só POSIX): coalescência de gerações entre workers
+except ImportError:
+    fcntl = None
 from datetime import datetime
 import traceback # Para logs de erro mais detalhados
+import unicodedata
+import uuid
+import base64
+import bisect
+import cProfile
+import gzip
+import hashlib
+import heapq
+import html
+import importlib
+import importlib.util
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import pstats
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+try:
+    from src import pdf_render
+except ImportError: # Executado como script (python src/main.py)
+    import pdf_render
+
+# Diretório de dados persistentes (banco SQLite, chave secreta), compartilhado entre os workers
+APP_DATA_DIR = os.getenv("APP_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance"))
+RECIPES_STORE_BACKEND = os.getenv("RECIPES_STORE", "sqlite")
+RECIPES_DB_PATH = os.getenv("RECIPES_DB_PATH", os.path.join(APP_DATA_DIR, "recipes.db"))
+os.makedirs(APP_DATA_DIR, exist_ok=True)
+
+def load_secret_key():
+    # A mesma chave em todos os workers e reinícios; caso contrário as sessões falham aleatoriamente
+    if os.getenv("SECRET_KEY"):
+        return os.getenv("SECRET_KEY")
+    key_path = os.path.join(APP_DATA_DIR, "secret_key")
+    if not os.path.exists(key_path):
+        # Escreve em arquivo temporário e cria o definitivo com link atômico: o primeiro worker vence
+        # O arquivo já nasce com permissão 0600: a chave nunca fica legível por outros usuários
+        tmp_path = f"{key_path}.{os.getpid()}.tmp"
+        try:
+            os.remove(tmp_path)  # Sobra de um processo anterior com o mesmo PID
+        except FileNotFoundError:
+            pass
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(24))
+        try:
+            os.link(tmp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(key_path, "rb") as f:
+        return f.read()
 
 # Configuração inicial do Flask
 app = Flask(__name__, template_folder="../templates") # Aponta para a pasta templates um nível acima
-app.config["SECRET_KEY"] = os.urandom(24) # Chave secreta para sessões
+app.config["SECRET_KEY"] = load_secret_key() # Chave secreta para sessões
 
 # Configuração do Flask-Login
 login_manager = LoginManager()
@@ -23,14 +93,66 @@ login_manager.login_view = "login" # Rota para redirecionar se não estiver loga
 API_KEY = os.getenv("GEMINI_API_KEY", "SUA_API_KEY_AQUI")
 if API_KEY == "SUA_API_KEY_AQUI":
     print("AVISO: Chave da API Gemini não configurada. A geração de receitas não funcionará.")
-else:
-    try:
-        genai.configure(api_key=API_KEY)
-        print("API Key do Gemini configurada com sucesso.")
-    except Exception as e:
-        # CORRIGIDO: f-string única
-        print(f"Erro ao configurar a API Key do Gemini: {e}")
-        API_KEY = "SUA_API_KEY_AQUI" # Reseta para evitar chamadas inválidas
+
+# --- Dependências Pesadas (importadas sob demanda) ---
+# google.generativeai e o WeasyPrint (com Pango/cairo) dominam o tempo de boot e a memória de cada worker.
+# São importados no primeiro uso: /login e /categories não esperam por eles, e workers que nunca
+# renderizam PDF não carregam o WeasyPrint. Com "gunicorn --preload" e PRELOAD_HEAVY_IMPORTS=1,
+# o master importa tudo uma vez e os workers herdam os módulos já carregados pelo fork.
+PRELOAD_HEAVY_IMPORTS = os.getenv("PRELOAD_HEAVY_IMPORTS") == "1"
+HEAVY_MODULES = ("google.generativeai", "google.api_core.exceptions", "weasyprint", "pypdf")
+PYPDF_AVAILABLE = importlib.util.find_spec("pypdf") is not None # Opcional: junta partes de PDFs grandes
+import_timings = {} # módulo -> segundos gastos na primeira importação neste processo
+_heavy_modules = {}
+_heavy_import_lock = threading.Lock()
+_genai_configured = False
+
+def heavy_import(module_name):
+    """Importa um módulo pesado no primeiro uso (uma vez por processo), registrando quanto tempo levou."""
+    module = _heavy_modules.get(module_name)
+    if module is not None:
+        return module
+    with _heavy_import_lock:
+        module = _heavy_modules.get(module_name)
+        if module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(module_name)
+            import_timings[module_name] = time.perf_counter() - started
+            _heavy_modules[module_name] = module
+            print(f"Módulo '{module_name}' importado sob demanda em {import_timings[module_name] * 1000:.0f} ms (pid {os.getpid()}).")
+    return module
+
+def gemini_sdk():
+    """google.generativeai já configurado com a API key; configure roda só na primeira chamada."""
+    global API_KEY, _genai_configured
+    genai = heavy_import("google.generativeai")
+    if not _genai_configured:
+        with _heavy_import_lock:
+            if not _genai_configured:
+                try:
+                    genai.configure(api_key=API_KEY)
+                    print("API Key do Gemini configurada com sucesso.")
+                except Exception as e:
+                    print(f"Erro ao configurar a API Key do Gemini: {e}")
+                    API_KEY = "SUA_API_KEY_AQUI" # Reseta para evitar chamadas inválidas
+                    raise
+                _genai_configured = True
+    return genai
+
+def google_api_exceptions():
+    return heavy_import("google.api_core.exceptions")
+
+def warm_heavy_imports():
+    """Importa as dependências pesadas agora. Só importa: nenhum cliente, thread ou conexão é criado,
+    então é seguro rodar no master do gunicorn (--preload) antes do fork dos workers."""
+    for module_name in HEAVY_MODULES:
+        if module_name == "pypdf" and not PYPDF_AVAILABLE:
+            continue
+        try:
+            heavy_import(module_name)
+        except (ImportError, OSError) as e:
+            # Ex.: WeasyPrint sem Pango no sistema; o erro reaparece (e é tratado) no primeiro uso
+            print(f"Aviso: não foi possível pré-carregar '{module_name}': {e}")
 
 # Modelo de usuário para Flask-Login (exemplo simples em memória)
 class User(UserMixin):
@@ -44,73 +166,1215 @@ users = {"1": User("1")} # Exemplo: usuário com id "1"
 def load_user(user_id):
     return users.get(user_id)
 
-# Simulação de "banco de dados" em memória para receitas
-recipes_db = {
-    "Café da Manhã": {
-        "Geral": [],
-        "Saudável": [],
-        "Rápido": [],
-    },
-    "Almoço": {
-        "Geral": [],
-        "Vegano": [],
-        "Low Carb": [],
-        "Rápido": [],
-        "Econômico": [],
-    },
-    "Jantar": {
-        "Geral": [],
-        "Leve": [],
-        "Sofisticado": [],
-    },
-    "Sobremesa": {
-        "Geral": [],
-        "Chocolate": [],
-        "Frutas": [],
-        "Fit": [],
-    },
-    "Lanches": {
-        "Geral": [],
-        "Salgado": [],
-        "Doce": [],
-        "Pré-treino": [],
-    }
+# --- Métricas e Instrumentação ---
+# Métricas em memória, por processo (cada worker do gunicorn expõe as suas), no formato de texto do Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1" # Permite o cabeçalho X-Profile: 1
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # Se definido, /metrics exige "Authorization: Bearer <token>"
+
+class MetricsRegistry:
+    """Contadores, histogramas de latência e gauges calculados na hora da coleta."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {} # nome -> (tipo, ajuda)
+        self._counters = {} # (nome, labels) -> valor
+        self._histograms = {} # (nome, labels) -> [contagens por bucket, soma, total]
+        self._collectors = [] # funções que devolvem [(nome, labels, valor)] na coleta
+
+    def describe(self, name, metric_type, help_text):
+        self._descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if index < len(LATENCY_BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("app_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    def render(self):
+        samples = {} # nome -> linhas
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: ([*value[0]], value[1], value[2]) for key, value in self._histograms.items()}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), (bucket_counts, total_sum, total_count) in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, bucket_counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {total_count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total_sum}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {total_count}")
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append(f"{name}{self._format_labels(tuple(sorted(labels.items())))} {value}")
+        output = []
+        for name in sorted(samples):
+            if name in self._descriptions:
+                metric_type, help_text = self._descriptions[name]
+                output.append(f"# HELP {name} {help_text}")
+                output.append(f"# TYPE {name} {metric_type}")
+            output.extend(samples[name])
+        return "\n".join(output) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("http_request_duration_seconds", "histogram", "Latência das requisições HTTP por rota, método e status.")
+metrics.describe("app_stage_duration_seconds", "histogram", "Duração de cada etapa interna (prompt, Gemini, análise do texto, DB, HTML e renderização do PDF).")
+metrics.describe("gemini_blocked_responses_total", "counter", "Respostas do Gemini bloqueadas por políticas de segurança.")
+metrics.describe("app_errors_total", "counter", "Erros tratados, por etapa.")
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+        print(f"Perfil de {request.method} {request.path}:\n{summary.getvalue()}")
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "<não mapeada>"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Não autorizado."}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Taxonomia fixa de categorias e subcategorias de receitas
+RECIPE_CATEGORIES = {
+    "Café da Manhã": ["Geral", "Saudável", "Rápido"],
+    "Almoço": ["Geral", "Vegano", "Low Carb", "Rápido", "Econômico"],
+    "Jantar": ["Geral", "Leve", "Sofisticado"],
+    "Sobremesa": ["Geral", "Chocolate", "Frutas", "Fit"],
+    "Lanches": ["Geral", "Salgado", "Doce", "Pré-treino"],
 }
+RECIPE_TAXONOMY_SIZE = sum(len(subcategories) for subcategories in RECIPE_CATEGORIES.values()) # Pares categoria/subcategoria
 
-# Função auxiliar para adicionar receita ao "DB"
-def add_recipe_to_db(category, subcategory, recipe_data):
-    effective_subcategory = subcategory if subcategory in recipes_db.get(category, {}) else "Geral"
-    if category in recipes_db and effective_subcategory in recipes_db[category]:
-        recipes_db[category][effective_subcategory].append(recipe_data)
-        if subcategory != effective_subcategory:
-             # CORRIGIDO: Usar f-string única e correta
-             print(f"Aviso: Subcategoria '{subcategory}' não encontrada em '{category}'. Adicionando em '{effective_subcategory}'.")
+RECIPE_ID_TIMESTAMP_RE = re.compile(r"_(\d+)$")
+RECIPE_EXCERPT_LENGTH = 150
+
+def parse_recipe_timestamp(recipe_id):
+    # IDs terminam com o timestamp de criação em ms (ex.: "Almoço_Geral_1717171717171")
+    match = RECIPE_ID_TIMESTAMP_RE.search(recipe_id)
+    return int(match.group(1)) if match else 0
+
+# --- Análise Estruturada das Receitas (markdown) ---
+# O texto gerado é analisado uma única vez, na entrada: título, ingredientes com quantidades, passos e
+# tempo total ficam prontos no registro. Filtros por tempo/ingredientes e o PDF não reanalisam o texto.
+RECIPE_TITLE_MIN_LENGTH = 4
+RECIPE_TITLE_MAX_LENGTH = 79
+RECIPE_SECTION_HEADING_MAX_LENGTH = 40
+RECIPE_LIST_ITEM_RE = re.compile(r"^(?:[-*•+]\s+|(?:\*\*)?\d{1,3}[.)]\s*)(.+)$")
+RECIPE_DURATION_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(horas?|hrs?|h|minutos?|mins?|min)(?!\w)")
+RECIPE_HOURS_MINUTES_RE = re.compile(r"(\d+)\s*h\s*(\d{1,2})(?![\d\w])") # "1h30" (sem unidade nos minutos)
+INGREDIENT_UNITS = (
+    r"kg|g|mg|ml|l|litros?|gramas?|quilos?|x[íi]caras?(?:\s+de\s+ch[áa])?|x[íi]c\.?"
+    r"|colher(?:es)?(?:\s+de\s+(?:sopa|ch[áa]|sobremesa|caf[ée]))?|colh\.?|copos?(?:\s+americanos?)?"
+    r"|dentes?|pitadas?|fatias?|latas?|unidades?|ma[çc]os?|ramos?|folhas?|pacotes?|caixas?|potes?"
+    r"|tabletes?|cubos?|punhados?|gotas?|talos?|peda[çc]os?|envelopes?|sach[êe]s?|fil[ée]s?|postas?"
+)
+INGREDIENT_QUANTITY_RE = re.compile(
+    r"^((?:\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?|[½⅓⅔¼¾⅛])(?:\s+(?:e\s+)?(?:\d+\s*/\s*\d+|[½⅓⅔¼¾]))?"
+    r"(?:\s*(?:-|a)\s*\d+(?:[.,]\d+)?)?"
+    rf"(?:\s*(?:{INGREDIENT_UNITS})(?!\w))?(?:\s*\([^)]*\))?)\s*(?:(?:de|da|do|d')\s+)?(.+)$",
+    re.IGNORECASE,
+)
+INGREDIENT_TO_TASTE_RE = re.compile(r"^(.+?)\s+(a gosto|q\.?\s*b\.?)$", re.IGNORECASE)
+# Seções reconhecidas pelo início do cabeçalho já normalizado (sem acentos, minúsculo)
+RECIPE_SECTION_KEYWORDS = (
+    ("ingredients", ("ingrediente",)),
+    ("steps", ("modo de preparo", "preparo", "instruc", "passo", "modo de fazer", "como fazer", "montagem")),
+    ("other", ("dica", "observ", "sugest", "variac", "rendimento", "porcao", "porcoes", "informac", "nutric", "armazen",
+               "acompanh", "harmoniz")),
+)
+RECIPE_UNTITLED = "Receita Gerada (Título não extraído)"
+# Palavras que descrevem o preparo do ingrediente, não o ingrediente: ficam fora dos tokens de filtro
+INGREDIENT_DESCRIPTOR_WORDS = frozenset(
+    "picado picada ralado ralada cortado cortada fatiado fatiada cubos tiras fresco fresca grande grandes "
+    "medio media pequeno pequena opcional gosto aproximadamente inteiro inteira bem maduro madura "
+    "descascado descascada sem pele sementes derretido derretida temperatura ambiente mais menos".split()
+)
+# (plural, singular, tamanho mínimo do radical): "pães" -> "pão", "nozes" -> "noz", mas "mais" não vira "mal"
+INGREDIENT_PLURAL_ENDINGS = (
+    ("oes", "ao", 1), ("aes", "ao", 1), ("ais", "al", 2), ("eis", "el", 2), ("zes", "z", 2), ("res", "r", 2),
+)
+
+def strip_markdown_decoration(text):
+    # Remove negrito/itálico e marcadores de título das pontas ("## **Bolo:**" -> "Bolo")
+    return re.sub(r"^[\s#*_]+|[\s#*_:]+$", "", text.replace("**", "").replace("__", ""))
+
+def normalize_ingredient_token(token):
+    # Singular aproximado, aplicado igualmente aos ingredientes salvos e aos filtros ("ovos" == "ovo")
+    for plural, singular, min_stem in INGREDIENT_PLURAL_ENDINGS:
+        if token.endswith(plural) and len(token) - len(plural) >= min_stem:
+            return token[:-len(plural)] + singular
+    if token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        return token[:-1]
+    return token
+
+def ingredient_tokens(text):
+    """Tokens normalizados de um nome de ingrediente (ou de um filtro), sem palavras descritivas."""
+    text = re.sub(r"\([^)]*\)", " ", text)
+    tokens = {
+        normalize_ingredient_token(token) for token in tokenize_search_text(text)
+        if not token.isdigit() and token not in INGREDIENT_DESCRIPTOR_WORDS
+    }
+    return tokens - INGREDIENT_DESCRIPTOR_WORDS
+
+def parse_duration_minutes(text):
+    text = RECIPE_HOURS_MINUTES_RE.sub(r"\1 h \2 min", text)
+    minutes = 0.0
+    for value, unit in RECIPE_DURATION_RE.findall(text):
+        value = float(value.replace(",", "."))
+        minutes += value * 60 if unit.startswith("h") else value
+    return round(minutes) if minutes else None
+
+def parse_ingredient(text):
+    """Separa quantidade e nome: "2 xícaras de farinha" -> ("2 xícaras", "farinha"); sem quantidade -> (None, texto)."""
+    match = INGREDIENT_QUANTITY_RE.match(text)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    match = INGREDIENT_TO_TASTE_RE.match(text)
+    if match:
+        return match.group(2), match.group(1).strip()
+    name, _, quantity = text.partition(":") # "Farinha: 2 xícaras"
+    if quantity.strip()[:1].isdigit():
+        return quantity.strip(), name.strip()
+    return None, text
+
+def recipe_section_of(heading, anywhere=False):
+    # Por padrão a palavra-chave precisa abrir a linha ("Modo de preparo"); anywhere=True também aceita
+    # no meio ("Para o preparo:"), só para linhas já marcadas como cabeçalho (evita "Lombo de Porco" etc.)
+    key = normalize_search_text(heading)
+    for section, keywords in RECIPE_SECTION_KEYWORDS:
+        if any(key.startswith(keyword) or (anywhere and f" {keyword}" in key) for keyword in keywords):
+            return section
+    return None
+
+def parse_recipe_text(recipe_text):
+    """Analisa o markdown da receita numa única passada.
+
+    Retorna um dict com title, ingredients (lista de pares [quantidade, nome]), steps, prep_minutes
+    (None se o texto não informar) e ingredient_tokens (tokens normalizados para filtros).
+    """
+    title = None
+    title_lines_left = 2
+    section = None
+    ingredients, steps = [], []
+    total_minutes = partial_minutes = None
+    for raw_line in recipe_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if title is None and title_lines_left:
+            # Título: a primeira linha, ou a seguinte se a primeira for curta demais ou só "Receita"
+            title_lines_left -= 1
+            candidate = strip_markdown_decoration(line)
+            placeholder = len(candidate) < RECIPE_TITLE_MIN_LENGTH or candidate.casefold() == "receita"
+            if not placeholder and len(candidate) <= RECIPE_TITLE_MAX_LENGTH and recipe_section_of(candidate) is None:
+                title = candidate
+                continue
+            if placeholder:
+                continue
+            title_lines_left = 0 # Linha de conteúdo: a receita não tem título extraível
+        item = RECIPE_LIST_ITEM_RE.match(line) if not line.startswith("#") else None
+        text = strip_markdown_decoration(item.group(1) if item else line)
+        if not text:
+            continue
+        key = normalize_search_text(text)
+        if key.startswith("tempo"):
+            minutes = parse_duration_minutes(key)
+            if minutes is not None:
+                if "total" in key:
+                    total_minutes = total_minutes or minutes
+                else:
+                    partial_minutes = (partial_minutes or 0) + minutes
+                continue
+        # Cabeçalho: "## ...", "**...**", "...:" ou só o nome da seção numa linha curta ("Ingredientes")
+        marked_heading = line.startswith("#") or (not item and (line.rstrip(":").endswith("**") or line.endswith(":")))
+        is_heading = marked_heading or (
+            not item and len(text) <= RECIPE_SECTION_HEADING_MAX_LENGTH and recipe_section_of(text) is not None
+        )
+        if is_heading:
+            heading_section = recipe_section_of(text, anywhere=marked_heading)
+            if heading_section is not None:
+                section = heading_section
+            elif line.startswith("#"):
+                section = "other"
+            # Cabeçalho em negrito sem seção conhecida ("**Para a massa:**") é um subgrupo da seção atual
+            continue
+        if section == "ingredients" and item:
+            ingredients.append(parse_ingredient(text))
+        elif section == "steps":
+            steps.append(text)
+    tokens = set()
+    for _, name in ingredients:
+        tokens |= ingredient_tokens(name)
+    if title is None:
+        title = "Receita Gerada (Texto Vazio)" if not recipe_text.strip() else RECIPE_UNTITLED
+    return {
+        "title": title,
+        "ingredients": ingredients,
+        "steps": steps,
+        "prep_minutes": total_minutes if total_minutes is not None else partial_minutes,
+        "ingredient_tokens": sorted(tokens),
+    }
+
+class Recipe:
+    """Registro compacto de uma receita gerada."""
+    __slots__ = ("id", "title", "category", "subcategory", "full_text", "created_ms",
+                 "ingredients", "steps", "prep_minutes", "ingredient_tokens")
+
+    def __init__(self, id, title, category, subcategory, full_text, structure=None):
+        self.id = id
+        self.title = title
+        self.category = category
+        self.subcategory = subcategory
+        self.full_text = full_text
+        self.created_ms = parse_recipe_timestamp(id)
+        # Campos derivados: analisados aqui só na entrada; o SQLite devolve os já calculados
+        if structure is None:
+            structure = parse_recipe_text(full_text)
+        self.ingredients = structure["ingredients"]
+        self.steps = structure["steps"]
+        self.prep_minutes = structure["prep_minutes"]
+        self.ingredient_tokens = frozenset(structure["ingredient_tokens"])
+
+    @property
+    def sort_key(self):
+        return (self.created_ms, self.id)
+
+    @classmethod
+    def from_dict(cls, data, structure=None):
+        return cls(data["id"], data["title"], data["category"], data["subcategory"], data["full_text"], structure)
+
+    def ingredients_dicts(self):
+        return [{"quantity": quantity, "name": name} for quantity, name in self.ingredients]
+
+    def matches(self, max_prep_minutes=None, ingredients=None):
+        """Filtros de listagem sobre os campos já calculados (sem reanalisar o texto)."""
+        if max_prep_minutes is not None and (self.prep_minutes is None or self.prep_minutes > max_prep_minutes):
+            return False
+        return not ingredients or self.ingredient_tokens.issuperset(ingredients)
+
+    def to_dict(self, is_favorite=False, fields=None):
+        if fields is None:
+            return {
+                "id": self.id,
+                "title": self.title,
+                "category": self.category,
+                "subcategory": self.subcategory,
+                "full_text": self.full_text,
+                "prep_minutes": self.prep_minutes,
+                "ingredients": self.ingredients_dicts(),
+                "steps": list(self.steps),
+                "is_favorite": is_favorite,
+            }
+        # Projeção esparsa (?fields=...): só calcula os campos pedidos
+        values = {"is_favorite": is_favorite}
+        for field in fields:
+            if field == "created_at":
+                values[field] = datetime.fromtimestamp(self.created_ms / 1000).isoformat(timespec="seconds")
+            elif field == "excerpt":
+                values[field] = self.full_text[:RECIPE_EXCERPT_LENGTH]
+            elif field == "ingredients":
+                values[field] = self.ingredients_dicts()
+            elif field == "steps":
+                values[field] = list(self.steps)
+            elif field != "is_favorite":
+                values[field] = getattr(self, field)
+        return {field: values[field] for field in fields}
+
+# --- Índice de Busca (títulos e textos das receitas) ---
+# Palavras muito comuns em português que não ajudam a distinguir receitas
+SEARCH_STOPWORDS = frozenset(
+    "a o e as os ao aos da das de do dos em na nas no nos um uma uns umas com sem por para pra ou que se ate".split()
+)
+# Vocabulário das instruções, presente em quase toda receita: não distingue nada e faria a busca pontuar o
+# catálogo inteiro. Fica fora só da busca (os tokens de ingredientes usam tokenize_search_text)
+SEARCH_BOILERPLATE_WORDS = frozenset(
+    "minuto minutos hora horas misture misturar misturando mexa mexendo mexer acrescente acrescentar adicione adicionar "
+    "junte juntar coloque colocar leve levar deixe deixar sirva servir despeje tempere cozinhe cozinhar aqueca preaqueca "
+    "retire bata bem aos poucos sempre cerca depois apos enquanto modo preparo ingrediente ingredientes receita tempo "
+    "total rendimento porcao porcoes xicara xicaras colher colheres gramas ml gosto pitada unidade unidades".split()
+)
+SEARCH_TITLE_WEIGHT = 3 # Termos no título valem mais que no corpo do texto
+SEARCH_BM25_K1 = 1.2
+# Poda top-k: só as N correspondências mais recentes de uma busca são pontuadas e ordenadas por relevância,
+# então termos frequentes não fazem a busca percorrer o catálogo inteiro
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "500"))
+
+def normalize_search_text(text):
+    # Remove acentos ("café" == "cafe") e ignora maiúsculas
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+def tokenize_search_text(text):
+    return [token for token in re.findall(r"[^\W_]+", normalize_search_text(text)) if len(token) > 1 and token not in SEARCH_STOPWORDS]
+
+def search_terms(text):
+    """Termos indexados e buscados: tokenize_search_text sem o vocabulário comum das instruções."""
+    return [token for token in tokenize_search_text(text) if token not in SEARCH_BOILERPLATE_WORDS]
+
+class RecipeSearchIndex:
+    """Índice invertido em memória: termo -> {id da receita: peso BM25 do termo na receita}."""
+
+    def __init__(self):
+        self._postings = {}
+        self._terms_by_id = {} # Para remover a versão anterior de uma receita substituída
+        self._lock = threading.Lock()
+
+    def add(self, recipe):
+        frequencies = Counter(search_terms(recipe.full_text))
+        for token in search_terms(recipe.title):
+            frequencies[token] += SEARCH_TITLE_WEIGHT
+        with self._lock:
+            self._remove_locked(recipe.id)
+            for token, tf in frequencies.items():
+                # Saturação do BM25 calculada na indexação; na busca resta só multiplicar pelo IDF
+                self._postings.setdefault(token, {})[recipe.id] = tf * (SEARCH_BM25_K1 + 1) / (tf + SEARCH_BM25_K1)
+            self._terms_by_id[recipe.id] = tuple(frequencies)
+
+    def _remove_locked(self, recipe_id):
+        for token in self._terms_by_id.pop(recipe_id, ()):
+            posting = self._postings[token]
+            posting.pop(recipe_id, None)
+            if not posting:
+                del self._postings[token]
+
+    def search(self, terms, limit, accept=None):
+        """IDs que contêm todos os termos, como pares (score, id) do mais ao menos relevante.
+
+        Só as SEARCH_RANK_WINDOW correspondências indexadas por último são pontuadas (poda top-k).
+        """
+        postings = [self._postings.get(term) for term in dict.fromkeys(terms)]
+        if not postings or not all(postings):
+            return []
+        total = max(len(self._terms_by_id), 1)
+        weighted = [(posting, math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))) for posting in postings]
+        # Interseção feita em C (dict_keys), partindo do termo mais raro
+        postings.sort(key=len)
+        rarest = postings[0]
+        matches = rarest.keys()
+        for posting in postings[1:]:
+            matches = matches & posting.keys()
+        if len(matches) <= SEARCH_RANK_WINDOW:
+            candidates = [recipe_id for recipe_id in matches if accept is None or accept(recipe_id)]
+        else:
+            # Janela cheia: percorre o termo mais raro do mais novo ao mais antigo (ordem de inserção do dict)
+            candidates = []
+            for recipe_id in reversed(rarest):
+                if recipe_id in matches and (accept is None or accept(recipe_id)):
+                    candidates.append(recipe_id)
+                    if len(candidates) >= SEARCH_RANK_WINDOW:
+                        break
+        scored = ((sum(posting[recipe_id] * idf for posting, idf in weighted), recipe_id) for recipe_id in candidates)
+        return heapq.nlargest(limit, scored)
+
+class RecipeStore:
+    """Base dos backends de receitas: taxonomia de categorias e operações comuns."""
+
+    def __init__(self, categories):
+        self.categories = categories
+        self.buckets = [(cat, sub) for cat, subs in categories.items() for sub in subs]
+
+    def __contains__(self, category):
+        return category in self.categories
+
+    def subcategories(self, category):
+        return self.categories.get(category, [])
+
+    def resolve_subcategory(self, category, subcategory):
+        # Subcategorias desconhecidas caem em "Geral"; None se a categoria não existe
+        if category not in self.categories:
+            return None
+        if subcategory in self.categories[category]:
+            return subcategory
+        return "Geral" if "Geral" in self.categories[category] else None
+
+    def add_many(self, recipes):
+        return sum(1 for recipe in recipes if self.add(recipe))
+
+    def iter_recipes(self, category=None, subcategory=None, after=None, descending=False, batch_size=500, **filters):
+        """Percorre as receitas em lotes paginados por cursor: só um lote fica em memória por vez."""
+        while True:
+            batch = self.list_recipes(category, subcategory, limit=batch_size, after=after, descending=descending, **filters)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1].sort_key
+
+class InMemoryRecipeStore(RecipeStore):
+    """Catálogo de receitas em memória, indexado por ID e por (categoria, subcategoria)."""
+
+    def __init__(self, categories):
+        super().__init__(categories)
+        self._by_id = {} # id -> Recipe
+        self._keys_by_bucket = {bucket: [] for bucket in self.buckets} # (created_ms, id) em ordem crescente
+        self._search_index = RecipeSearchIndex()
+        self._pool = {bucket: deque() for bucket in self.buckets} # Receitas pré-geradas, ainda não vistas
+        self._version = 0 # Muda sempre que a contagem de algum bucket muda
+        self._favorites = {} # user_id -> set de IDs de receitas
+        self._lock = threading.Lock()
+
+    def add(self, recipe, replace=True):
+        with self._lock:
+            keys = self._keys_by_bucket.get((recipe.category, recipe.subcategory))
+            if keys is None:
+                return False
+            previous = self._by_id.get(recipe.id)
+            if previous is not None and not replace:
+                return False
+            if previous is not None:
+                self._keys_by_bucket[(previous.category, previous.subcategory)].remove(recipe.sort_key)
+            if previous is None or (previous.category, previous.subcategory) != (recipe.category, recipe.subcategory):
+                self._version += 1
+            # IDs novos têm timestamp crescente, então na prática isto é um append
+            bisect.insort(keys, recipe.sort_key)
+            self._by_id[recipe.id] = recipe
+        self._search_index.add(recipe) # Indexação incremental, fora do lock do catálogo
         return True
-    elif category in recipes_db and "Geral" in recipes_db[category]:
-         recipes_db[category]["Geral"].append(recipe_data)
-         # CORRIGIDO: Usar f-string única e correta
-         print(f"Aviso: Subcategoria '{subcategory}' inválida para '{category}'. Adicionando em 'Geral'.")
-         return True
-    else:
+
+    def get(self, recipe_id):
+        return self._by_id.get(recipe_id)
+
+    def get_many(self, recipe_ids):
+        # Mantém a ordem pedida, ignorando IDs repetidos ou inexistentes
+        found = (self._by_id.get(recipe_id) for recipe_id in dict.fromkeys(recipe_ids))
+        return [recipe for recipe in found if recipe is not None]
+
+    def list_recipes(self, category=None, subcategory=None, limit=None, after=None, descending=False, favorites_of=None,
+                     max_prep_minutes=None, ingredients=None):
+        """Receitas ordenadas por criação; 'after' é a chave (created_ms, id) do último item já visto.
+
+        `max_prep_minutes` e `ingredients` (tokens de ingrediente_tokens()) filtram pelos campos já analisados.
+        """
+        if favorites_of is not None:
+            # Parte só dos favoritos do usuário (poucos), sem percorrer o catálogo
+            with self._lock:
+                favorites = [self._by_id[recipe_id] for recipe_id in self._favorites.get(favorites_of, ()) if recipe_id in self._by_id]
+            buckets = [sorted(
+                recipe.sort_key for recipe in favorites
+                if (category is None or recipe.category == category) and (subcategory is None or recipe.subcategory == subcategory)
+            )]
+        elif category is None:
+            buckets = self._keys_by_bucket.values()
+        elif subcategory is None:
+            buckets = [self._keys_by_bucket[(category, sub)] for sub in self.subcategories(category)]
+        else:
+            buckets = [self._keys_by_bucket.get((category, subcategory), [])]
+
+        iterators = []
+        for keys in buckets:
+            if descending:
+                end = bisect.bisect_left(keys, after) if after else len(keys)
+                iterators.append(map(keys.__getitem__, range(end - 1, -1, -1)))
+            else:
+                start = bisect.bisect_right(keys, after) if after else 0
+                iterators.append(itertools.islice(keys, start, None))
+        # Intercala as subcategorias já ordenadas sem ordenar o catálogo inteiro
+        merged = heapq.merge(*iterators, reverse=descending)
+        recipes = (self._by_id[recipe_id] for _, recipe_id in merged)
+        if max_prep_minutes is not None or ingredients:
+            recipes = (recipe for recipe in recipes if recipe.matches(max_prep_minutes, ingredients))
+        return list(itertools.islice(recipes, limit))
+
+    def count(self, category, subcategory):
+        return len(self._keys_by_bucket.get((category, subcategory), []))
+
+    def counts(self):
+        return {bucket: len(keys) for bucket, keys in self._keys_by_bucket.items()}
+
+    def catalog_version(self):
+        return self._version
+
+    def search(self, terms, category=None, limit=20):
+        """Receitas que contêm todos os termos (já normalizados), como pares (Recipe, score)."""
+        accept = (lambda recipe_id: self._by_id[recipe_id].category == category) if category else None
+        return [(self._by_id[recipe_id], score) for score, recipe_id in self._search_index.search(terms, limit, accept)]
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def pool_push(self, category, subcategory, full_text):
+        with self._lock:
+            pool = self._pool.get((category, subcategory))
+            if pool is None:
+                return False
+            pool.append(full_text)
+            return True
+
+    def pool_pop(self, category, subcategory):
+        """Remove e devolve o texto pré-gerado mais antigo do bucket (None se vazio)."""
+        with self._lock:
+            pool = self._pool.get((category, subcategory))
+            return pool.popleft() if pool else None
+
+    def pool_depths(self):
+        with self._lock:
+            return {bucket: len(pool) for bucket, pool in self._pool.items()}
+
+    def favorite_ids(self, user_id):
+        with self._lock:
+            return set(self._favorites.get(user_id, ()))
+
+    def add_favorites(self, user_id, recipe_ids):
+        """Marca receitas existentes como favoritas (IDs desconhecidos são ignorados). Retorna quantas eram novas."""
+        with self._lock:
+            favorites = self._favorites.setdefault(user_id, set())
+            new_ids = {recipe_id for recipe_id in recipe_ids if recipe_id in self._by_id} - favorites
+            favorites |= new_ids
+            return len(new_ids)
+
+    def remove_favorite(self, user_id, recipe_id):
+        with self._lock:
+            favorites = self._favorites.get(user_id, set())
+            if recipe_id not in favorites:
+                return False
+            favorites.discard(recipe_id)
+            return True
+
+class SQLiteRecipeStore(RecipeStore):
+    """Catálogo de receitas em SQLite (modo WAL), compartilhado entre os workers do gunicorn."""
+
+    # Cada item é aplicado uma única vez, na ordem; a versão atual fica em PRAGMA user_version
+    MIGRATIONS = [
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            category TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            full_text TEXT NOT NULL,
+            created_ms INTEGER NOT NULL
+        );
+        -- Cobre filtros por categoria e por (categoria, subcategoria), já na ordem de criação
+        CREATE INDEX IF NOT EXISTS idx_recipes_category ON recipes (category, subcategory, created_ms);
+        CREATE INDEX IF NOT EXISTS idx_recipes_created ON recipes (created_ms);
+        """,
+        """
+        -- Paginação por cursor (created_ms, id) sem ordenação em memória, inclusive filtrando só por categoria
+        DROP INDEX IF EXISTS idx_recipes_category;
+        DROP INDEX IF EXISTS idx_recipes_created;
+        CREATE INDEX IF NOT EXISTS idx_recipes_subcategory_created ON recipes (category, subcategory, created_ms, id);
+        CREATE INDEX IF NOT EXISTS idx_recipes_category_created ON recipes (category, created_ms, id);
+        CREATE INDEX IF NOT EXISTS idx_recipes_created ON recipes (created_ms, id);
+        """,
+        """
+        -- Índice de busca FTS5 sem acentos ("café" == "cafe"), mantido pelos gatilhos a cada escrita
+        CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+            title, full_text, content='recipes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_insert AFTER INSERT ON recipes BEGIN
+            INSERT INTO recipes_fts (rowid, title, full_text) VALUES (new.rowid, new.title, new.full_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_delete AFTER DELETE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, title, full_text) VALUES ('delete', old.rowid, old.title, old.full_text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipes_fts_update AFTER UPDATE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, title, full_text) VALUES ('delete', old.rowid, old.title, old.full_text);
+            INSERT INTO recipes_fts (rowid, title, full_text) VALUES (new.rowid, new.title, new.full_text);
+        END;
+        INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild');
+        """,
+        """
+        -- Pool de receitas pré-geradas em segundo plano, compartilhado entre os workers
+        CREATE TABLE IF NOT EXISTS recipe_pool (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            full_text TEXT NOT NULL,
+            created_ms INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_recipe_pool_bucket ON recipe_pool (category, subcategory, seq);
+        """,
+        """
+        -- Contagens por (categoria, subcategoria) e versão do catálogo mantidas pelos gatilhos a cada escrita:
+        -- /categories não varre a tabela de receitas, e todos os workers enxergam a mesma versão
+        CREATE TABLE IF NOT EXISTS recipe_counts (
+            category TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (category, subcategory)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL);
+        INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+        DELETE FROM recipe_counts;
+        INSERT INTO recipe_counts (category, subcategory, total)
+            SELECT category, subcategory, COUNT(*) FROM recipes GROUP BY category, subcategory;
+        CREATE TRIGGER IF NOT EXISTS recipe_counts_insert AFTER INSERT ON recipes BEGIN
+            INSERT INTO recipe_counts (category, subcategory, total) VALUES (new.category, new.subcategory, 1)
+                ON CONFLICT (category, subcategory) DO UPDATE SET total = total + 1;
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipe_counts_delete AFTER DELETE ON recipes BEGIN
+            UPDATE recipe_counts SET total = total - 1 WHERE category = old.category AND subcategory = old.subcategory;
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipe_counts_update AFTER UPDATE OF category, subcategory ON recipes
+        WHEN old.category != new.category OR old.subcategory != new.subcategory BEGIN
+            UPDATE recipe_counts SET total = total - 1 WHERE category = old.category AND subcategory = old.subcategory;
+            INSERT INTO recipe_counts (category, subcategory, total) VALUES (new.category, new.subcategory, 1)
+                ON CONFLICT (category, subcategory) DO UPDATE SET total = total + 1;
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END;
+        """,
+        """
+        -- Favoritos por usuário: pertinência pela chave primária, sem listas de IDs na URL
+        CREATE TABLE IF NOT EXISTS favorites (
+            user_id TEXT NOT NULL,
+            recipe_id TEXT NOT NULL,
+            added_ms INTEGER NOT NULL,
+            PRIMARY KEY (user_id, recipe_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_favorites_recipe ON favorites (recipe_id);
+        CREATE TRIGGER IF NOT EXISTS favorites_recipe_delete AFTER DELETE ON recipes BEGIN
+            DELETE FROM favorites WHERE recipe_id = old.id;
+        END;
+        """,
+        """
+        -- Campos estruturados extraídos do markdown na entrada (receitas antigas: _backfill_structured_fields).
+        -- Tokens de ingredientes indexados por gatilhos: filtrar por ingrediente não lê o texto das receitas
+        ALTER TABLE recipes ADD COLUMN prep_minutes INTEGER;
+        ALTER TABLE recipes ADD COLUMN ingredient_tokens TEXT NOT NULL DEFAULT '[]';
+        ALTER TABLE recipes ADD COLUMN structure TEXT;
+        CREATE TABLE IF NOT EXISTS recipe_ingredients (
+            token TEXT NOT NULL,
+            recipe_id TEXT NOT NULL,
+            PRIMARY KEY (token, recipe_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe ON recipe_ingredients (recipe_id);
+        CREATE TRIGGER IF NOT EXISTS recipe_ingredients_insert AFTER INSERT ON recipes BEGIN
+            INSERT OR IGNORE INTO recipe_ingredients (token, recipe_id) SELECT value, new.id FROM json_each(new.ingredient_tokens);
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipe_ingredients_delete AFTER DELETE ON recipes BEGIN
+            DELETE FROM recipe_ingredients WHERE recipe_id = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS recipe_ingredients_update AFTER UPDATE OF ingredient_tokens ON recipes BEGIN
+            DELETE FROM recipe_ingredients WHERE recipe_id = old.id;
+            INSERT OR IGNORE INTO recipe_ingredients (token, recipe_id) SELECT value, new.id FROM json_each(new.ingredient_tokens);
+        END;
+        """,
+        """
+        -- Regra de plural dos tokens corrigida ("pães" == "pão"): só recalcula os campos estruturados
+        """,
+        """
+        -- Títulos com palavras de seção ("Lombo de Porco") e plurais em -es ("nozes"): recalcula os campos estruturados
+        """,
+        """
+        -- Busca: a categoria vira coluna do FTS (um token por categoria, ex.: "cafedamanha"), então o filtro por
+        -- categoria é uma interseção dentro do índice em vez de uma consulta à tabela para cada correspondência
+        ALTER TABLE recipes ADD COLUMN category_key TEXT GENERATED ALWAYS AS (replace(category, ' ', '')) VIRTUAL;
+        DROP TRIGGER IF EXISTS recipes_fts_insert;
+        DROP TRIGGER IF EXISTS recipes_fts_delete;
+        DROP TRIGGER IF EXISTS recipes_fts_update;
+        DROP TABLE IF EXISTS recipes_fts;
+        CREATE VIRTUAL TABLE recipes_fts USING fts5(
+            title, full_text, category_key, content='recipes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER recipes_fts_insert AFTER INSERT ON recipes BEGIN
+            INSERT INTO recipes_fts (rowid, title, full_text, category_key) VALUES (new.rowid, new.title, new.full_text, new.category_key);
+        END;
+        CREATE TRIGGER recipes_fts_delete AFTER DELETE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, title, full_text, category_key)
+                VALUES ('delete', old.rowid, old.title, old.full_text, old.category_key);
+        END;
+        CREATE TRIGGER recipes_fts_update AFTER UPDATE ON recipes BEGIN
+            INSERT INTO recipes_fts (recipes_fts, rowid, title, full_text, category_key)
+                VALUES ('delete', old.rowid, old.title, old.full_text, old.category_key);
+            INSERT INTO recipes_fts (rowid, title, full_text, category_key) VALUES (new.rowid, new.title, new.full_text, new.category_key);
+        END;
+        INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild');
+        """,
+    ]
+    STRUCTURED_FIELDS_VERSION = 9 # Última migração que exige recalcular (em Python) os campos estruturados
+    COLUMNS = "id, title, category, subcategory, full_text, prep_minutes, ingredient_tokens, structure"
+    INSERT_COLUMNS = "id, title, category, subcategory, full_text, created_ms, prep_minutes, ingredient_tokens, structure"
+    INSERT_PLACEHOLDERS = ", ".join("?" * 9)
+    SQLITE_MAX_VARIABLES = 500 # Tamanho dos lotes de IDs em consultas "IN (...)"
+
+    def __init__(self, categories, path):
+        super().__init__(categories)
+        self.path = path
+        self._local = threading.local()
+        self._migrate()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL") # Leitores não bloqueiam o escritor (e vice-versa)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connection(self):
+        # Uma conexão por thread, reaproveitada entre requisições; recriada após um fork (gunicorn --preload)
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self._connect()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _migrate(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE") # Serializa a migração entre workers iniciando juntos
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            for index, script in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                # Separa os comandos respeitando ";" dentro de gatilhos (BEGIN ... END)
+                statement = ""
+                for part in script.split(";"):
+                    statement += part + ";"
+                    if sqlite3.complete_statement(statement):
+                        if statement.strip(" \n;"):
+                            connection.execute(statement)
+                        statement = ""
+                connection.execute(f"PRAGMA user_version = {index}")
+            if version < self.STRUCTURED_FIELDS_VERSION <= len(self.MIGRATIONS):
+                self._backfill_structured_fields(connection)
+            connection.commit()
+        finally:
+            connection.close()
+
+    @classmethod
+    def _backfill_structured_fields(cls, connection, batch_size=500):
+        # Analisa uma única vez as receitas gravadas antes da migração (o título salvo só é trocado se não foi extraído)
+        last_rowid = 0
+        while True:
+            rows = connection.execute(
+                "SELECT rowid, title, full_text FROM recipes WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for rowid, title, full_text in rows:
+                structure = parse_recipe_text(full_text)
+                updates.append((
+                    structure["title"] if title == RECIPE_UNTITLED else title,
+                    structure["prep_minutes"],
+                    json.dumps(structure["ingredient_tokens"], ensure_ascii=False),
+                    cls._structure_json(structure),
+                    rowid,
+                ))
+            connection.executemany(
+                "UPDATE recipes SET title = ?, prep_minutes = ?, ingredient_tokens = ?, structure = ? WHERE rowid = ?", updates
+            )
+            last_rowid = rows[-1][0]
+            print(f"Migração: campos estruturados calculados até a linha {last_rowid}.")
+
+    @staticmethod
+    def _structure_json(structure):
+        return json.dumps({"ingredients": structure["ingredients"], "steps": structure["steps"]}, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def _recipe_from_row(row):
+        recipe_id, title, category, subcategory, full_text, prep_minutes, tokens_json, structure_json = row
+        structure = json.loads(structure_json) if structure_json else {"ingredients": [], "steps": []}
+        structure["prep_minutes"] = prep_minutes
+        structure["ingredient_tokens"] = json.loads(tokens_json)
+        return Recipe(recipe_id, title, category, subcategory, full_text, structure)
+
+    @classmethod
+    def _recipe_values(cls, recipe):
+        return (
+            recipe.id, recipe.title, recipe.category, recipe.subcategory, recipe.full_text, recipe.created_ms, recipe.prep_minutes,
+            json.dumps(sorted(recipe.ingredient_tokens), ensure_ascii=False),
+            cls._structure_json({"ingredients": recipe.ingredients, "steps": recipe.steps}),
+        )
+
+    def add(self, recipe, replace=True):
+        if replace:
+            return self.add_many([recipe]) == 1
+        if (recipe.category, recipe.subcategory) not in set(self.buckets):
+            return False
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                f"INSERT OR IGNORE INTO recipes ({self.INSERT_COLUMNS}) VALUES ({self.INSERT_PLACEHOLDERS})",
+                self._recipe_values(recipe),
+            )
+        return cursor.rowcount == 1
+
+    def add_many(self, recipes):
+        valid_buckets = set(self.buckets)
+        rows = [self._recipe_values(r) for r in recipes if (r.category, r.subcategory) in valid_buckets]
+        connection = self._connection()
+        with connection: # Uma única transação para o lote inteiro
+            connection.executemany(
+                f"INSERT INTO recipes ({self.INSERT_COLUMNS}) VALUES ({self.INSERT_PLACEHOLDERS}) "
+                "ON CONFLICT(id) DO UPDATE SET title = excluded.title, category = excluded.category, "
+                "subcategory = excluded.subcategory, full_text = excluded.full_text, prep_minutes = excluded.prep_minutes, "
+                "ingredient_tokens = excluded.ingredient_tokens, structure = excluded.structure",
+                rows,
+            )
+        return len(rows)
+
+    def get(self, recipe_id):
+        row = self._connection().execute(f"SELECT {self.COLUMNS} FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+        return self._recipe_from_row(row) if row else None
+
+    def get_many(self, recipe_ids):
+        wanted = list(dict.fromkeys(recipe_ids))
+        found = {}
+        for start in range(0, len(wanted), self.SQLITE_MAX_VARIABLES):
+            chunk = wanted[start:start + self.SQLITE_MAX_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            for row in self._connection().execute(f"SELECT {self.COLUMNS} FROM recipes WHERE id IN ({placeholders})", chunk):
+                found[row[0]] = self._recipe_from_row(row)
+        return [found[recipe_id] for recipe_id in wanted if recipe_id in found]
+
+    def list_recipes(self, category=None, subcategory=None, limit=None, after=None, descending=False, favorites_of=None,
+                     max_prep_minutes=None, ingredients=None):
+        conditions, params = [], []
+        if favorites_of is not None:
+            conditions.append("favorites.user_id = ?")
+            params.append(favorites_of)
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if category is not None and subcategory is not None:
+            conditions.append("subcategory = ?")
+            params.append(subcategory)
+        if max_prep_minutes is not None:
+            conditions.append("prep_minutes <= ?")
+            params.append(max_prep_minutes)
+        for token in sorted(ingredients or ()):
+            # Cada token é uma busca pela chave primária de recipe_ingredients
+            conditions.append("id IN (SELECT recipe_id FROM recipe_ingredients WHERE token = ?)")
+            params.append(token)
+        if after:
+            operator = "<" if descending else ">"
+            conditions.append(f"(created_ms {operator} ? OR (created_ms = ? AND id {operator} ?))")
+            params.extend([after[0], after[0], after[1]])
+        query = f"SELECT {self.COLUMNS} FROM recipes"
+        if favorites_of is not None:
+            # CROSS JOIN fixa a ordem: parte dos favoritos do usuário (poucos), não do índice do catálogo
+            query = f"SELECT {self.COLUMNS} FROM favorites CROSS JOIN recipes ON recipes.id = favorites.recipe_id"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = "DESC" if descending else "ASC"
+        query += f" ORDER BY created_ms {direction}, id {direction}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [self._recipe_from_row(row) for row in self._connection().execute(query, params)]
+
+    def count(self, category, subcategory):
+        row = self._connection().execute(
+            "SELECT total FROM recipe_counts WHERE category = ? AND subcategory = ?", (category, subcategory)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def counts(self):
+        counts = dict.fromkeys(self.buckets, 0)
+        for category, subcategory, total in self._connection().execute("SELECT category, subcategory, total FROM recipe_counts"):
+            if (category, subcategory) in counts:
+                counts[(category, subcategory)] = total
+        return counts
+
+    def catalog_version(self):
+        # Consulta de uma linha pela chave primária: barata o bastante para cada requisição
+        return self._connection().execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+
+    def favorite_ids(self, user_id):
+        rows = self._connection().execute("SELECT recipe_id FROM favorites WHERE user_id = ?", (user_id,))
+        return {row[0] for row in rows}
+
+    def add_favorites(self, user_id, recipe_ids):
+        """Marca receitas existentes como favoritas (IDs desconhecidos são ignorados). Retorna quantas eram novas."""
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        added_ms = int(time.time() * 1000)
+        added = 0
+        connection = self._connection()
+        with connection:
+            for start in range(0, len(recipe_ids), self.SQLITE_MAX_VARIABLES):
+                chunk = recipe_ids[start:start + self.SQLITE_MAX_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                added += connection.execute(
+                    f"INSERT OR IGNORE INTO favorites (user_id, recipe_id, added_ms) "
+                    f"SELECT ?, id, ? FROM recipes WHERE id IN ({placeholders})",
+                    [user_id, added_ms, *chunk],
+                ).rowcount
+        return added
+
+    def remove_favorite(self, user_id, recipe_id):
+        connection = self._connection()
+        with connection:
+            return connection.execute(
+                "DELETE FROM favorites WHERE user_id = ? AND recipe_id = ?", (user_id, recipe_id)
+            ).rowcount == 1
+
+    def search(self, terms, category=None, limit=20):
+        # Termos já vêm normalizados (só letras/dígitos), então podem ir entre aspas na expressão MATCH
+        expression = " ".join(f'"{term}"' for term in dict.fromkeys(terms))
+        if category:
+            category_key = " ".join(re.findall(r"[^\W_]+", normalize_search_text(category.replace(" ", ""))))
+            expression = f'({expression}) AND category_key : "{category_key}"'
+        # Poda top-k: o FTS5 percorre as correspondências da mais nova para a mais antiga (rowid) e só as
+        # SEARCH_RANK_WINDOW primeiras passam pelo bm25() e pela ordenação; o join com recipes é só para `limit` linhas
+        columns = ", ".join(f"r.{column.strip()}" for column in self.COLUMNS.split(","))
+        query = (
+            f"SELECT {columns}, f.rank FROM ("
+            "SELECT rowid, bm25(recipes_fts, ?, 1.0, 0.0) AS rank FROM recipes_fts WHERE recipes_fts MATCH ? "
+            "ORDER BY rowid DESC LIMIT ?"
+            ") f JOIN recipes r ON r.rowid = f.rowid ORDER BY f.rank LIMIT ?"
+        )
+        params = [float(SEARCH_TITLE_WEIGHT), expression, SEARCH_RANK_WINDOW, limit]
+        # bm25() do SQLite é negativo (menor = mais relevante); invertido para manter "maior = melhor"
+        return [(self._recipe_from_row(row[:-1]), -row[-1]) for row in self._connection().execute(query, params)]
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    def pool_push(self, category, subcategory, full_text):
+        if (category, subcategory) not in set(self.buckets):
+            return False
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO recipe_pool (category, subcategory, full_text, created_ms) VALUES (?, ?, ?, ?)",
+                (category, subcategory, full_text, int(time.time() * 1000)),
+            )
+        return True
+
+    def pool_pop(self, category, subcategory):
+        """Remove e devolve o texto pré-gerado mais antigo do bucket (None se vazio)."""
+        connection = self._connection()
+        for _ in range(3):
+            row = connection.execute(
+                "SELECT seq, full_text FROM recipe_pool WHERE category = ? AND subcategory = ? ORDER BY seq LIMIT 1",
+                (category, subcategory),
+            ).fetchone()
+            if row is None:
+                return None
+            with connection:
+                deleted = connection.execute("DELETE FROM recipe_pool WHERE seq = ?", (row[0],)).rowcount
+            if deleted: # Senão outro worker levou a mesma receita: tenta a próxima
+                return row[1]
+        return None
+
+    def pool_depths(self):
+        depths = dict.fromkeys(self.buckets, 0)
+        rows = self._connection().execute("SELECT category, subcategory, COUNT(*) FROM recipe_pool GROUP BY category, subcategory")
+        for category, subcategory, depth in rows:
+            if (category, subcategory) in depths:
+                depths[(category, subcategory)] = depth
+        return depths
+
+def create_recipe_store(backend):
+    if backend == "memory":
+        return InMemoryRecipeStore(RECIPE_CATEGORIES)
+    if backend == "sqlite":
+        return SQLiteRecipeStore(RECIPE_CATEGORIES, RECIPES_DB_PATH)
+    raise ValueError(f"Backend de receitas desconhecido: '{backend}' (use 'sqlite' ou 'memory').")
+
+# "Banco de dados" de receitas: SQLite por padrão; RECIPES_STORE=memory mantém tudo em memória do processo
+recipes_db = create_recipe_store(RECIPES_STORE_BACKEND)
+
+# Função auxiliar para adicionar receita ao "DB"
+def add_recipe_to_db(category, subcategory, recipe_data, replace=True):
+    effective_subcategory = recipes_db.resolve_subcategory(category, subcategory)
+    if effective_subcategory is None:
         # CORRIGIDO: Usar f-string única e correta
         print(f"Erro: Categoria '{category}' não encontrada no banco de dados.")
         return False
+    if subcategory != effective_subcategory:
+        # CORRIGIDO: Usar f-string única e correta
+        print(f"Aviso: Subcategoria '{subcategory}' não encontrada em '{category}'. Adicionando em '{effective_subcategory}'.")
+    # Mantém o registro devolvido ao cliente consistente com onde a receita foi armazenada
+    recipe_data["subcategory"] = effective_subcategory
+    # Análise única do markdown: título, ingredientes, passos e tempo seguem prontos no registro e no store
+    with metrics.timer("recipe_parsing"):
+        structure = parse_recipe_text(recipe_data["full_text"])
+    recipe_data["title"] = structure["title"]
+    recipe = Recipe.from_dict(recipe_data, structure)
+    recipe_data.update(prep_minutes=recipe.prep_minutes, ingredients=recipe.ingredients_dicts(), steps=list(recipe.steps))
+    return recipes_db.add(recipe, replace=replace)
+
+# --- Cache de Respostas da Geração de Receitas ---
+# Evita chamadas repetidas à API Gemini para a mesma combinação de categoria/subcategoria/ingredientes
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "256"))
+RECIPE_CACHE_TTL_SECONDS = float(os.getenv("RECIPE_CACHE_TTL_SECONDS", "3600"))
+MAX_PROMPT_INGREDIENTS = 10 # Mesmo limite usado na montagem do prompt
+
+class RecipeCache:
+    """Cache LRU com expiração (TTL) para receitas geradas, seguro para uso entre threads."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # chave -> (expira_em, receita)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key) # Marca como usado recentemente
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False) # Remove o menos usado recentemente
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+recipe_cache = RecipeCache(RECIPE_CACHE_MAX_ENTRIES, RECIPE_CACHE_TTL_SECONDS)
+
+metrics.describe("recipe_cache_events_total", "counter", "Acessos ao cache de receitas geradas (hit/miss/eviction).")
+metrics.describe("recipe_cache_entries", "gauge", "Receitas atualmente no cache de geração.")
+def collect_recipe_cache_metrics():
+    stats = recipe_cache.stats()
+    return [
+        ("recipe_cache_events_total", {"event": "hit"}, stats["hits"]),
+        ("recipe_cache_events_total", {"event": "miss"}, stats["misses"]),
+        ("recipe_cache_events_total", {"event": "eviction"}, stats["evictions"]),
+        ("recipe_cache_entries", {}, stats["entries"]),
+    ]
+metrics.register_collector(collect_recipe_cache_metrics)
+
+def make_recipe_cache_key(category, subcategory, ingredients):
+    # Ingredientes: mesmos 10 do prompt, sem diferenciar maiúsculas, espaços extras ou ordem
+    normalized_ingredients = {" ".join(str(i).split()).casefold() for i in ingredients[:MAX_PROMPT_INGREDIENTS]}
+    normalized_ingredients.discard("")
+    return (
+        category.strip().casefold(),
+        (subcategory or "").strip().casefold(),
+        tuple(sorted(normalized_ingredients)),
+    )
+
+# --- Páginas Pré-compiladas (login e home) ---
+# As páginas não dependem da requisição: são renderizadas uma vez, já comprimidas e com ETag.
+# TEMPLATES_AUTO_RELOAD=1 (desenvolvimento) recarrega o template quando o arquivo muda no disco.
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD") == "1"
+app.config["TEMPLATES_AUTO_RELOAD"] = TEMPLATES_AUTO_RELOAD
+
+class PrecompiledPage:
+    """Template estático renderizado uma vez, com corpos gzip/brotli e ETag pré-calculados."""
+
+    def __init__(self, template_name, auto_reload=False):
+        self.template_name = template_name
+        self.path = os.path.join(app.root_path, app.template_folder, template_name)
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._load()
 
-# Função para tentar extrair o título da receita do texto gerado
-def extract_title(recipe_text):
-    lines = recipe_text.strip().split("\n")
-    if not lines:
-        return "Receita Gerada (Texto Vazio)"
-    potential_title = lines[0].strip()
-    potential_title = re.sub(r"^[\*#]+\s*|\s*[\*#]+$", "", potential_title)
-    if len(potential_title) < 80 and len(potential_title) > 3:
-        return potential_title
-    if len(lines) > 1 and (len(potential_title) <= 3 or potential_title.lower() == "receita"):
-        potential_title_2 = lines[1].strip()
-        potential_title_2 = re.sub(r"^[\*#]+\s*|\s*[\*#]+$", "", potential_title_2)
-        if len(potential_title_2) < 80 and len(potential_title_2) > 3:
-            return potential_title_2
-    return "Receita Gerada (Título não extraído)"
+    def _load(self):
+        self._mtime = os.stat(self.path).st_mtime
+        body = app.jinja_env.get_template(self.template_name).render().encode("utf-8")
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+
+    def _reload_if_changed(self):
+        if self.auto_reload and os.stat(self.path).st_mtime != self._mtime:
+            with self._lock:
+                if os.stat(self.path).st_mtime != self._mtime:
+                    print(f"Template '{self.template_name}' alterado; recompilando.")
+                    self._load()
+
+    def response(self):
+        self._reload_if_changed()
+        if request.if_none_match.contains_weak(self.etag):
+            response = Response(status=304)
+        else:
+            # Melhor codificação aceita pelo cliente entre as pré-calculadas
+            encoding = max(
+                (name for name in ("br", "gzip") if name in self.bodies and request.accept_encodings[name]),
+                key=lambda name: request.accept_encodings[name],
+                default="identity",
+            )
+            response = Response(self.bodies[encoding], mimetype="text/html")
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+        # ETag fraca: a mesma para todas as codificações do mesmo conteúdo
+        response.set_etag(self.etag, weak=True)
+        response.headers["Vary"] = "Accept-Encoding"
+        # Páginas atrás de login: o navegador guarda, mas sempre revalida (barato, via 304)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+login_page = PrecompiledPage("login.html", auto_reload=TEMPLATES_AUTO_RELOAD)
+index_page = PrecompiledPage("index.html", auto_reload=TEMPLATES_AUTO_RELOAD)
 
 # --- Rotas de Autenticação (Exemplo Básico) ---
 @app.route("/login", methods=["GET", "POST"])
@@ -125,116 +1389,8 @@ def login():
             return jsonify({"message": "Login bem-sucedido! Redirecionando...", "redirect": "/"})
         # Na prática, você validaria o usuário/senha aqui
         return "Usuário ou senha inválidos", 401
-    # Formulário de login com design mais leve (Ajustado)
-    return render_template_string("""
-        <!DOCTYPE html>
-        <html lang="pt-BR">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Login - App de Receitas</title>
-            <style>
-                /* Adiciona link para fonte Inter */
-                @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
-
-                body {
-                    font-family: 'Inter', -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
-                    background-color: #f7f7f7; /* Fundo ainda mais claro */
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    min-height: 100vh;
-                    margin: 0;
-                }
-                .login-container {
-                    background-color: #ffffff;
-                    padding: 40px 50px;
-                    border-radius: 12px; /* Bordas mais arredondadas */
-                    box-shadow: 0 6px 20px rgba(0, 0, 0, 0.06); /* Sombra um pouco mais pronunciada */
-                    text-align: center;
-                    max-width: 360px; /* Um pouco mais estreito */
-                    width: 90%;
-                }
-                h2 {
-                    color: #333; /* Cor de título um pouco mais suave */
-                    margin-bottom: 30px; /* Mais espaço abaixo do título */
-                    font-weight: 600;
-                    font-size: 1.6em;
-                }
-                .input-group {
-                    margin-bottom: 20px; /* Mais espaço entre os campos */
-                    text-align: left;
-                }
-                label {
-                    display: block;
-                    margin-bottom: 8px; /* Mais espaço abaixo do label */
-                    color: #555; /* Cor de label mais escura */
-                    font-size: 0.9em;
-                    font-weight: 500;
-                }
-                input[type="text"],
-                input[type="password"] {
-                    width: 100%;
-                    padding: 12px 15px; /* Campos um pouco maiores */
-                    border: 1px solid #ddd; /* Borda mais sutil */
-                    border-radius: 8px; /* Bordas mais arredondadas para inputs */
-                    box-sizing: border-box;
-                    font-size: 1em;
-                    transition: border-color 0.2s ease, box-shadow 0.2s ease;
-                }
-                input[type="text"]:focus,
-                input[type="password"]:focus {
-                    outline: none;
-                    border-color: #a0cfff; /* Azul bem claro no foco */
-                    box-shadow: 0 0 0 3px rgba(0, 110, 255, 0.1);
-                }
-                input[type="submit"] {
-                    background: linear-gradient(to right, #6a11cb 0%, #2575fc 100%); /* Gradiente estilo Gamma */
-                    color: white;
-                    border: none;
-                    padding: 14px 20px; /* Botão maior */
-                    border-radius: 8px;
-                    cursor: pointer;
-                    font-size: 1.05em;
-                    font-weight: 500;
-                    width: 100%;
-                    transition: opacity 0.2s ease, transform 0.1s ease;
-                    margin-top: 20px; /* Mais espaço acima do botão */
-                    box-shadow: 0 4px 10px rgba(0, 123, 255, 0.2);
-                }
-                input[type="submit"]:hover {
-                    opacity: 0.9;
-                }
-                 input[type="submit"]:active {
-                    transform: scale(0.97);
-                    box-shadow: 0 2px 5px rgba(0, 123, 255, 0.2);
-                 }
-                p {
-                    color: #888; /* Cinza mais claro */
-                    font-size: 0.85em;
-                    margin-top: 25px;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="login-container">
-                <h2>Login</h2>
-                <form method="post">
-                    <div class="input-group">
-                        <label for="username">Usuário:</label>
-                        <input type="text" id="username" name="username" value="user" required>
-                    </div>
-                    <div class="input-group">
-                        <label for="password">Senha:</label>
-                        <input type="password" id="password" name="password" value="pass" required>
-                    </div>
-                    <input type="submit" value="Entrar">
-                </form>
-                <p>(Use usuário "user" e senha "pass")</p>
-            </div>
-        </body>
-        </html>
-    """)
+    # Formulário de login com design mais leve (Ajustado), pré-compilado em templates/login.html
+    return login_page.response()
 
 @app.route("/logout")
 @login_required
@@ -246,133 +1402,1094 @@ def logout():
 @app.route("/")
 @login_required
 def home():
-    # Lê o conteúdo do index.html a cada requisição (bom para desenvolvimento)
+    # Página pré-compilada na inicialização (TEMPLATES_AUTO_RELOAD=1 recarrega ao editar o arquivo)
     try:
-        with open("templates/index.html", "r", encoding="utf-8") as f:
-            template_content = f.read()
-        return render_template_string(template_content)
-    except FileNotFoundError:
-        # CORRIGIDO: f-string única
-        print("Erro Crítico: Arquivo de template 'templates/index.html' não encontrado.")
-        return "Erro interno: Arquivo de template principal não encontrado.", 500
+        return index_page.response()
     except Exception as e:
         # CORRIGIDO: f-string única
-        print(f"Erro ao ler template 'templates/index.html': {e}\n{traceback.format_exc()}")
+        print(f"Erro ao carregar template 'templates/index.html': {e}\n{traceback.format_exc()}")
         return "Erro interno ao carregar a página.", 500
 
 # --- Rota para Geração de Receitas ---
-@app.route("/generate_recipe", methods=["POST"])
-@login_required
-def generate_recipe_route():
-    data = request.get_json()
+GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+
+def validate_generation_request(data):
+    """Valida o corpo JSON de uma geração. Retorna (category, subcategory, ingredients, erro)."""
     if not data:
-        return jsonify({"error": "Requisição sem dados JSON."}), 400
+        return None, None, None, "Requisição sem dados JSON."
+    if not isinstance(data, dict):
+        return None, None, None, "O corpo JSON deve ser um objeto."
     category = data.get("category")
     subcategory = data.get("subcategory", "")
-    ingredients = data.get("ingredients", [])
+    ingredients = data.get("ingredients") or [] # "ingredients": null equivale a lista vazia
+    if not isinstance(ingredients, list) or not all(isinstance(ingredient, str) for ingredient in ingredients):
+        return None, None, None, "'ingredients' deve ser uma lista de textos."
     if not category:
-         return jsonify({"error": "Categoria é obrigatória."}), 400
+        return None, None, None, "Categoria é obrigatória."
     if category not in recipes_db:
-         # CORRIGIDO: Usar f-string única
-         return jsonify({"error": f"Categoria '{category}' inválida."}), 400
+        return None, None, None, f"Categoria '{category}' inválida."
+    return category, subcategory, ingredients, None
 
+def build_recipe_prompt(category, subcategory, ingredients):
     # CORRIGIDO: Usar f-string única para montar o prompt
     prompt = f"Gere uma receita detalhada para a categoria '{category}'"
     if subcategory:
         prompt += f" com foco específico em '{subcategory}'"
     if ingredients:
-        ingredients_str = ", ".join(ingredients[:10]) # Limita a 10 ingredientes no prompt
+        ingredients_str = ", ".join(ingredients[:MAX_PROMPT_INGREDIENTS]) # Limita a 10 ingredientes no prompt
         prompt += f" usando principalmente os seguintes ingredientes: {ingredients_str}"
     prompt += ". A receita deve incluir um título claro e chamativo, a lista de ingredientes completa com quantidades exatas, instruções passo a passo bem detalhadas e o tempo estimado de preparo total."
     prompt += " Formate a resposta de forma clara e organizada, usando markdown para títulos, listas e negrito quando apropriado."
+    return prompt
 
-    try:
-        if API_KEY == "SUA_API_KEY_AQUI":
-            # CORRIGIDO: f-string única
-            print("Tentativa de gerar receita sem API Key configurada.")
-            return jsonify({"error": "API Key do Gemini não configurada no servidor."}), 500
+_last_recipe_timestamp_ms = 0
+_recipe_timestamp_lock = threading.Lock()
+
+def next_recipe_timestamp_ms():
+    # Timestamp em ms estritamente crescente: gerações simultâneas (ex.: lotes) não colidem no ID
+    global _last_recipe_timestamp_ms
+    with _recipe_timestamp_lock:
+        _last_recipe_timestamp_ms = max(int(datetime.now().timestamp() * 1000), _last_recipe_timestamp_ms + 1)
+        return _last_recipe_timestamp_ms
+
+def build_recipe_data(category, subcategory, recipe_text):
+    # Título e campos estruturados são preenchidos por add_recipe_to_db, na análise do texto
+    # Cria um ID mais robusto e único
+    recipe_id = f"{category.replace(' ', '_')}_{subcategory.replace(' ', '_') if subcategory else 'Geral'}_{next_recipe_timestamp_ms()}"
+    return {
+        "id": recipe_id,
+        "title": None,
+        "category": category,
+        "subcategory": subcategory if subcategory else "Geral",
+        "full_text": recipe_text,
+        "is_favorite": False # Inicialmente não é favorito
+    }
+
+RECIPE_ID_MAX_ATTEMPTS = 5
+
+def save_generated_recipe(category, subcategory, recipe_text, cache_key):
+    """Monta o registro da receita, salva no "DB" e no cache. Retorna None se não foi possível salvar."""
+    for attempt in range(RECIPE_ID_MAX_ATTEMPTS):
+        recipe_data = build_recipe_data(category, subcategory, recipe_text)
+        with metrics.timer("db_insert"):
+            saved = add_recipe_to_db(category, subcategory, recipe_data, replace=False)
+        if saved or recipes_db.get(recipe_data["id"]) is None:
+            break
+        # Outro worker gravou uma receita no mesmo milissegundo (comum com gerações coalescidas): novo ID
+    if not saved:
+        # A função add_recipe_to_db já imprime o erro
+        return None
+    # CORRIGIDO: Usar f-string única
+    print(f"Receita '{recipe_data['title']}' adicionada a {category}/{recipe_data['subcategory']}")
+    recipe_cache.set(cache_key, recipe_data)
+    return recipe_data
+
+class RecipeGenerationError(Exception):
+    """Falha de geração com a mensagem e o status HTTP que devem ser devolvidos ao cliente."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+# --- Cliente Gemini: Limite de Taxa, Novas Tentativas e Circuit Breaker ---
+# Limites por processo: com vários workers, divida a cota da conta (GEMINI_RPM) pelo número de workers.
+# O burst padrão cobre um lote com a taxonomia inteira (ver RECIPE_BATCH_MAX_WORKERS): com burst menor, cada
+# chamada além dele espera 60/GEMINI_RPM s na fila, e as que passariam de GEMINI_QUEUE_MAX_WAIT_SECONDS recebem 429.
+# A média continua limitada a GEMINI_RPM; reduza o burst se a cota da conta não tolerar esse pico.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", str(RECIPE_TAXONOMY_SIZE)))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "30"))
+GEMINI_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_QUEUE_MAX_WAIT_SECONDS", "10"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_SECONDS = float(os.getenv("GEMINI_BACKOFF_SECONDS", "1.0"))
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+GEMINI_DEGRADED_FALLBACK = os.getenv("GEMINI_DEGRADED_FALLBACK", "1") == "1"
+GEMINI_RETRYABLE_ERRORS = ("ResourceExhausted", "ServiceUnavailable", "InternalServerError") # em google.api_core.exceptions
+
+class GeminiUnavailableError(Exception):
+    """O Gemini não pôde atender agora (circuito aberto, cota local esgotada ou falhas após novas tentativas)."""
 
-        model = genai.GenerativeModel("gemini-1.5-flash-latest")
+    def __init__(self, message, status_code=503, retry_after=None, upstream_failure=False):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.upstream_failure = upstream_failure # True se a falha foi do Gemini (conta para o circuit breaker)
+
+class TokenBucket:
+    """Limitador de taxa adaptativo: reduz a taxa pela metade a cada 429 e a recupera aos poucos com sucessos."""
+
+    def __init__(self, requests_per_minute, burst):
+        self.max_rate = requests_per_minute / 60.0
+        self.min_rate = self.max_rate / 8
+        self.rate = self.max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Reserva um token, esperando no máximo max_wait segundos. Retorna False (sem reservar) se a espera seria maior."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+            if wait > max_wait:
+                return False
+            self.tokens -= 1 # Pode ficar negativo: é a fila de quem já reservou e está esperando
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class CircuitBreaker:
+    """Após N falhas seguidas abre o circuito (falha rápida); depois do intervalo, deixa passar uma chamada de teste."""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _transition_locked(self, state):
+        if state != self._state:
+            print(f"Circuit breaker do Gemini: {self._state} -> {state}")
+            metrics.inc("gemini_circuit_transitions_total", to=state)
+            self._state = state
+
+    def _current_state_locked(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._transition_locked(self.HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state_locked()
+
+    def retry_after(self):
+        """Segundos até o circuito aceitar uma chamada de teste (0 se não está aberto)."""
+        with self._lock:
+            if self._current_state_locked() != self.OPEN:
+                return 0
+            return max(0, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+
+    def allow(self):
+        with self._lock:
+            state = self._current_state_locked()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        # A chamada liberada não chegou ao Gemini (ex.: cota local): outra pode fazer o teste
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._transition_locked(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition_locked(self.OPEN)
+
+class GeminiClient:
+    """Único ponto de chamada ao Gemini: limite de taxa, novas tentativas com backoff e circuit breaker."""
+
+    def __init__(self, model_name, limiter, breaker, max_retries, base_delay):
+        self.model_name = model_name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+    def generate(self, prompt, stream=False, timeout=None, queue_wait=None):
+        if not self.breaker.allow():
+            metrics.inc("gemini_circuit_rejections_total")
+            raise GeminiUnavailableError("O serviço de geração está temporariamente indisponível. Tente novamente em instantes.",
+                                         503, self.breaker.retry_after())
+        try:
+            response = self._generate_with_retries(prompt, stream, timeout, queue_wait)
+        except BaseException as e:
+            # Qualquer saída sem resposta encerra a sondagem do half-open: falhas do Gemini contam para o circuito,
+            # o resto (cota local, SDK ausente, erro de programação) só devolve a vez
+            if self._is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            raise
+        return self._succeeded(response)
+
+    @staticmethod
+    def _is_upstream_failure(error):
+        if isinstance(error, GeminiUnavailableError):
+            return error.upstream_failure
+        upstream_errors = (ConnectionError, TimeoutError)
+        google_exceptions = _heavy_modules.get("google.api_core.exceptions")
+        if google_exceptions is not None:
+            upstream_errors += (google_exceptions.GoogleAPICallError, google_exceptions.RetryError)
+        return isinstance(error, upstream_errors)
+
+    def _generate_with_retries(self, prompt, stream, timeout, queue_wait):
+        genai = gemini_sdk()
+        google_exceptions = google_api_exceptions()
+        retryable_errors = tuple(getattr(google_exceptions, name) for name in GEMINI_RETRYABLE_ERRORS)
+        deadline = time.monotonic() + (timeout or GEMINI_TIMEOUT_SECONDS)
+        attempt = 0
+        while True:
+            max_wait = GEMINI_QUEUE_MAX_WAIT_SECONDS if queue_wait is None else queue_wait
+            if not self.limiter.acquire(max_wait=min(max_wait, deadline - time.monotonic())):
+                metrics.inc("gemini_local_rate_limited_total")
+                raise GeminiUnavailableError("Muitas gerações em andamento. Tente novamente em instantes.", 429)
+            try:
+                model = genai.GenerativeModel(self.model_name)
+                return model.generate_content(
+                    prompt, stream=stream, request_options={"timeout": max(1.0, deadline - time.monotonic())})
+            except retryable_errors as e:
+                rate_limited = isinstance(e, google_exceptions.ResourceExhausted)
+                if rate_limited:
+                    self.limiter.throttled()
+                delay = self.base_delay * (2 ** attempt) + random.uniform(0, self.base_delay)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    if rate_limited:
+                        raise GeminiUnavailableError("Limite de requisições do Gemini excedido após novas tentativas.", 429,
+                                                     upstream_failure=True) from e
+                    raise GeminiUnavailableError("O serviço de geração está instável no momento. Tente novamente em instantes.", 503,
+                                                 upstream_failure=True) from e
+                attempt += 1
+                metrics.inc("gemini_retries_total", reason=type(e).__name__)
+                print(f"Gemini respondeu {type(e).__name__}. Nova tentativa em {delay:.1f}s ({attempt}/{self.max_retries}).")
+                time.sleep(delay)
+            except google_exceptions.DeadlineExceeded as e:
+                raise GeminiUnavailableError("Tempo limite excedido ao gerar a receita.", 504, upstream_failure=True) from e
+
+    def _succeeded(self, response):
+        self.breaker.record_success()
+        self.limiter.succeeded()
+        return response
+
+    def upstream_state(self):
+        return {"state": self.breaker.state, "retry_after": self.breaker.retry_after()}
+
+gemini_client = GeminiClient(
+    GEMINI_MODEL_NAME,
+    TokenBucket(GEMINI_RPM, GEMINI_BURST),
+    CircuitBreaker(GEMINI_BREAKER_FAILURE_THRESHOLD, GEMINI_BREAKER_RESET_SECONDS),
+    GEMINI_MAX_RETRIES,
+    GEMINI_BACKOFF_SECONDS,
+)
+
+metrics.describe("gemini_circuit_state", "gauge", "Estado do circuit breaker do Gemini (0 = fechado, 1 = meio aberto, 2 = aberto).")
+metrics.describe("gemini_rate_limit_rpm", "gauge", "Taxa atual permitida pelo limitador adaptativo (requisições/minuto).")
+metrics.describe("gemini_circuit_transitions_total", "counter", "Mudanças de estado do circuit breaker do Gemini.")
+metrics.describe("gemini_circuit_rejections_total", "counter", "Chamadas recusadas na hora por circuito aberto.")
+metrics.describe("gemini_local_rate_limited_total", "counter", "Chamadas recusadas pelo limitador local após esperar demais.")
+metrics.describe("gemini_retries_total", "counter", "Novas tentativas de chamadas ao Gemini, por tipo de erro.")
+metrics.describe("gemini_degraded_responses_total", "counter", "Receitas existentes servidas no lugar de uma geração com o Gemini indisponível.")
+
+GEMINI_CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+def collect_gemini_client_metrics():
+    return [
+        ("gemini_circuit_state", {}, GEMINI_CIRCUIT_STATE_VALUES[gemini_client.breaker.state]),
+        ("gemini_rate_limit_rpm", {}, round(gemini_client.limiter.rate * 60, 3)),
+    ]
+
+metrics.register_collector(collect_gemini_client_metrics)
+
+GEMINI_ENDPOINTS = {"generate_recipe_route", "generate_recipes_batch_route", "generate_recipe_stream_route"}
+
+@app.after_request
+def add_upstream_state_header(response):
+    # Clientes (e balanceadores) enxergam quando o Gemini está degradado, mesmo em respostas de sucesso
+    if request.endpoint in GEMINI_ENDPOINTS:
+        response.headers["X-Upstream-State"] = gemini_client.breaker.state
+    return response
+
+def upstream_unavailable_response(error):
+    body = {"error": error.message, "upstream": gemini_client.upstream_state()}
+    response = jsonify(body)
+    response.status_code = error.status_code
+    if error.retry_after:
+        response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+def degraded_recipe(category, subcategory, ingredients, cache_key):
+    """Receita já existente para servir com o Gemini indisponível: cache, depois o catálogo. Retorna (recipe_data, do_cache) ou None."""
+    cached_recipe = recipe_cache.get(cache_key)
+    if cached_recipe is not None:
+        return cached_recipe, True
+    effective_subcategory = recipes_db.resolve_subcategory(category, subcategory)
+    terms = tokenize_search_text(" ".join(str(i) for i in ingredients[:MAX_PROMPT_INGREDIENTS]))
+    candidates = [recipe for recipe, _ in recipes_db.search(terms, category=category)] if terms else []
+    if not candidates:
+        candidates = recipes_db.list_recipes(category, effective_subcategory, limit=20, descending=True) or \
+                     recipes_db.list_recipes(category, limit=20, descending=True)
+    if not candidates:
+        return None
+    # Prefere a subcategoria pedida; entre as recentes, sorteia para não repetir sempre a mesma
+    preferred = [recipe for recipe in candidates if recipe.subcategory == effective_subcategory] or candidates
+    recipe = preferred[0] if terms else random.choice(preferred)
+    return recipe.to_dict(), False
+
+# --- Coalescência de Gerações Idênticas (single-flight) ---
+# Pedidos idênticos simultâneos esperam uma única chamada ao Gemini em andamento e compartilham o resultado
+SINGLEFLIGHT_CROSS_PROCESS = os.getenv("SINGLEFLIGHT_CROSS_PROCESS") == "1"
+SINGLEFLIGHT_DIR = os.path.join(APP_DATA_DIR, "singleflight")
+SINGLEFLIGHT_RESULT_TTL_SECONDS = float(os.getenv("SINGLEFLIGHT_RESULT_TTL_SECONDS", "30"))
+# Falhas transitórias do líder valem só por alguns segundos: quem já esperava recebe o erro em vez de chamar de novo
+SINGLEFLIGHT_ERROR_TTL_SECONDS = float(os.getenv("SINGLEFLIGHT_ERROR_TTL_SECONDS", "5"))
+SINGLEFLIGHT_LOCK_POLL_SECONDS = 0.05
+SINGLEFLIGHT_FILE_MAX_AGE_SECONDS = 3600
+COALESCE_MODES = ("separate", "shared")
+
+class SingleFlight:
+    """Deduplica chamadas concorrentes com a mesma chave entre threads: só a primeira executa, as demais esperam."""
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Retorna (resultado, compartilhado). Exceções da chamada líder são repassadas a todos que esperavam."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+class FileSingleFlight:
+    """Coalescência entre workers: flock num arquivo por chave; o resultado (JSON) fica num arquivo ao lado."""
+
+    def __init__(self, directory, result_ttl, error_ttl):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.error_ttl = error_ttl
+        self._last_purge = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return f"{base}.lock", f"{base}.json"
+
+    def _read_result(self, path, waiting_since):
+        # Só vale um resultado escrito depois que este pedido começou a esperar: veio de uma chamada concorrente
+        try:
+            mtime = os.stat(path).st_mtime
+            if mtime < waiting_since or mtime < time.time() - self.result_ttl:
+                return None
+            with open(path, encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if "unavailable" in result and mtime < time.time() - self.error_ttl:
+            return None
+        return result
+
+    def _write_result(self, path, payload):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < 300:
+            return
+        self._last_purge = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < now - SINGLEFLIGHT_FILE_MAX_AGE_SECONDS:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _acquire(self, lock_file, deadline):
+        # Espera limitada pelo prazo do pedido: sem LOCK_NB, uma fila de N pedidos iguais poderia levar N x o timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise GeminiUnavailableError("Tempo limite excedido aguardando uma geração idêntica em andamento.", 504)
+                time.sleep(SINGLEFLIGHT_LOCK_POLL_SECONDS)
+
+    def do(self, key, func, timeout=None):
+        """Retorna (resultado, compartilhado). O resultado de func precisa ser serializável em JSON."""
+        lock_path, result_path = self._paths(key)
+        waiting_since = time.time()
+        deadline = time.monotonic() + (timeout or GEMINI_TIMEOUT_SECONDS)
+        with open(lock_path, "a+b") as lock_file:
+            self._acquire(lock_file, deadline)
+            try:
+                shared = self._read_result(result_path, waiting_since)
+                if shared is not None:
+                    if "error" in shared:
+                        raise RecipeGenerationError(shared["error"], shared["status_code"])
+                    if "unavailable" in shared:
+                        raise GeminiUnavailableError(shared["unavailable"], shared["status_code"])
+                    return shared["value"], True
+                try:
+                    value = func()
+                except RecipeGenerationError as e:
+                    # Bloqueios de segurança valem para todos que esperavam
+                    self._write_result(result_path, {"error": e.message, "status_code": e.status_code})
+                    raise
+                except GeminiUnavailableError as e:
+                    # Falha transitória: gravada com validade curta (error_ttl) só para quem já estava na fila
+                    self._write_result(result_path, {"unavailable": e.message, "status_code": e.status_code})
+                    raise
+                self._write_result(result_path, {"value": value})
+                return value, False
+            finally:
+                os.utime(lock_path) # Mantém o arquivo de lock "vivo" para a limpeza por idade
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._purge()
+
+single_flight = SingleFlight()
+file_single_flight = None
+if SINGLEFLIGHT_CROSS_PROCESS:
+    if fcntl is None:
+        print("Aviso: SINGLEFLIGHT_CROSS_PROCESS requer fcntl (POSIX). Coalescência apenas entre threads.")
+    else:
+        file_single_flight = FileSingleFlight(SINGLEFLIGHT_DIR, SINGLEFLIGHT_RESULT_TTL_SECONDS, SINGLEFLIGHT_ERROR_TTL_SECONDS)
+
+metrics.describe("gemini_coalesced_requests_total", "counter", "Gerações atendidas por uma chamada ao Gemini já em andamento (scope=thread|process).")
+
+def coalesced(key, func, timeout=None):
+    """Executa func uma única vez para chamadas concorrentes com a mesma chave. Retorna (resultado, compartilhado)."""
+    if file_single_flight is not None:
+        inner = lambda: file_single_flight.do(key, func, timeout)
+    else:
+        inner = lambda: (func(), False)
+    (value, shared_across_processes), shared = single_flight.do(key, inner)
+    if shared:
+        metrics.inc("gemini_coalesced_requests_total", scope="thread")
+    elif shared_across_processes:
+        metrics.inc("gemini_coalesced_requests_total", scope="process")
+    return value, shared or shared_across_processes
+
+def parse_coalesce_mode(value):
+    """'separate' (padrão): texto compartilhado, mas cada pedido ganha seu próprio id; 'shared': todos recebem a mesma receita; false desliga."""
+    if value is None or value is True:
+        return "separate"
+    if value is False:
+        return None
+    if value in COALESCE_MODES:
+        return value
+    raise ValueError(f"Valor inválido para 'coalesce': use {', '.join(COALESCE_MODES)} ou false.")
+
+# --- Pool de Receitas Pré-geradas ---
+# Pedidos sem ingredientes são atendidos na hora com receitas geradas antes, em segundo plano
+RECIPE_POOL_SIZE = int(os.getenv("RECIPE_POOL_SIZE", "2")) # Por (categoria, subcategoria); 0 desativa
+RECIPE_POOL_REFILL_INTERVAL_SECONDS = float(os.getenv("RECIPE_POOL_REFILL_INTERVAL_SECONDS", "10"))
+# Com o pool no SQLite (compartilhado), só o worker que segura este flock repõe: o ritmo não multiplica pelos workers
+RECIPE_POOL_REFILL_LOCK_PATH = os.path.join(APP_DATA_DIR, "recipe_pool_refill.lock")
+
+def pool_prompt_subcategory(subcategory):
+    # O bucket "Geral" corresponde a pedidos sem subcategoria: mesmo prompt que eles receberiam
+    return "" if subcategory == "Geral" else subcategory
+
+class RecipePoolRefiller:
+    """Thread em segundo plano que completa o pool, uma geração por intervalo e só com cota sobrando no limitador."""
+
+    def __init__(self, target_size, interval, lock_path=None):
+        self.target_size = target_size
+        self.interval = interval
+        self.lock_path = lock_path # None: pool do próprio processo (store em memória), cada worker repõe o seu
+        self._lock_file = None
+        self._started_pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Iniciada sob demanda (primeira requisição de cada worker): nada de threads no import nem no master do gunicorn
+        if self._started_pid == os.getpid() or self.target_size <= 0 or API_KEY == "SUA_API_KEY_AQUI":
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._lock_file = None # Herdado de outro processo: o flock é deste worker
+            threading.Thread(target=self._run, name="recipe-pool-refill", daemon=True).start()
+            print(f"Reposição do pool de receitas iniciada (alvo {self.target_size} por subcategoria, a cada {self.interval:g}s).")
+
+    def is_leader(self):
+        """Se este processo é o que repõe o pool compartilhado. Tentado a cada rodada: se o líder morre,
+        o kernel solta o flock e outro worker assume na rodada seguinte."""
+        if self.lock_path is None or fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, "a+b")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB) # Já é nosso: retorna na hora
+        except BlockingIOError:
+            return False
+        return True
+
+    def next_bucket(self):
+        """Bucket mais vazio abaixo do alvo, ou None se o pool está cheio."""
+        depths = recipes_db.pool_depths()
+        missing = [(depth, bucket) for bucket, depth in depths.items() if depth < self.target_size]
+        return min(missing)[1] if missing else None
+
+    def refill_one(self, category, subcategory):
+        # Pedidos de usuários têm prioridade: sem circuito fechado ou sem token livre agora, fica para a próxima rodada
+        if gemini_client.breaker.state != CircuitBreaker.CLOSED:
+            return False
+        prompt = build_recipe_prompt(category, pool_prompt_subcategory(subcategory), [])
+        try:
+            with metrics.timer("pool_refill"):
+                response = gemini_client.generate(prompt, queue_wait=0)
+        except GeminiUnavailableError:
+            return False
+        if not response.parts:
+            metrics.inc("gemini_blocked_responses_total")
+            return False
+        recipes_db.pool_push(category, subcategory, response.text)
+        metrics.inc("recipe_pool_refills_total")
+        return True
+
+    def _run(self):
+        leader = False
+        while True:
+            try:
+                if self.is_leader():
+                    if not leader and self.lock_path is not None:
+                        print(f"Reposição do pool de receitas compartilhado assumida por este worker (pid {os.getpid()}).")
+                    leader = True
+                    bucket = self.next_bucket()
+                    if bucket is not None:
+                        self.refill_one(*bucket)
+            except Exception as e:
+                print(f"Erro ao repor o pool de receitas: {e}\n{traceback.format_exc()}")
+            time.sleep(self.interval)
+
+recipe_pool_refiller = RecipePoolRefiller(
+    RECIPE_POOL_SIZE, RECIPE_POOL_REFILL_INTERVAL_SECONDS,
+    lock_path=RECIPE_POOL_REFILL_LOCK_PATH if isinstance(recipes_db, SQLiteRecipeStore) else None,
+)
+
+@app.before_request
+def start_background_workers():
+    recipe_pool_refiller.ensure_started()
+
+metrics.describe("recipe_pool_depth", "gauge", "Receitas pré-geradas disponíveis por categoria/subcategoria.")
+metrics.describe("recipe_pool_requests_total", "counter", "Pedidos sem ingredientes atendidos (hit) ou não (miss) pelo pool.")
+metrics.describe("recipe_pool_refills_total", "counter", "Receitas pré-geradas adicionadas ao pool.")
+
+def collect_recipe_pool_metrics():
+    if RECIPE_POOL_SIZE <= 0:
+        return []
+    return [
+        ("recipe_pool_depth", {"category": category, "subcategory": subcategory}, depth)
+        for (category, subcategory), depth in recipes_db.pool_depths().items()
+    ]
+
+metrics.register_collector(collect_recipe_pool_metrics)
+
+def take_pooled_recipe(category, subcategory, cache_key):
+    """Salva e devolve uma receita do pool para o pedido, ou None se o bucket está vazio."""
+    if RECIPE_POOL_SIZE <= 0:
+        return None
+    if subcategory and subcategory not in recipes_db.subcategories(category):
+        # Subcategoria livre: o pedido leva o foco dela no prompt, que nenhuma receita pré-gerada tem
+        return None
+    recipe_text = recipes_db.pool_pop(category, recipes_db.resolve_subcategory(category, subcategory))
+    if recipe_text is None:
+        metrics.inc("recipe_pool_requests_total", result="miss")
+        return None
+    metrics.inc("recipe_pool_requests_total", result="hit")
+    print(f"Receita servida do pool de pré-geradas: {category}/{subcategory or 'Geral'}")
+    return save_generated_recipe(category, subcategory, recipe_text, cache_key)
+
+def generation_info(**flags):
+    # Como a receita foi obtida; todas as respostas de geração trazem as mesmas chaves
+    return {"cached": False, "coalesced": False, "degraded": False, "pooled": False, **flags}
+
+def generate_recipe(category, subcategory, ingredients, use_cache=True, timeout=None, coalesce="separate", use_pool=True):
+    """Gera uma receita com o Gemini (ou a busca no cache) e a salva. Retorna (recipe_data, info da geração)."""
+    # "use_cache": false ignora receitas em cache (a nova receita gerada ainda atualiza o cache)
+    cache_key = make_recipe_cache_key(category, subcategory, ingredients)
+    # Sem ingredientes, o pool vem antes do cache: o usuário recebe uma receita nova, não a mesma de antes
+    if use_pool and not ingredients:
+        pooled_recipe = take_pooled_recipe(category, subcategory, cache_key)
+        if pooled_recipe is not None:
+            return pooled_recipe, generation_info(pooled=True)
+    if use_cache:
+        cached_recipe = recipe_cache.get(cache_key)
+        if cached_recipe is not None:
+            print(f"Receita servida do cache: {cached_recipe['title']}")
+            return cached_recipe, generation_info(cached=True)
+
+    if API_KEY == "SUA_API_KEY_AQUI":
+        # CORRIGIDO: f-string única
+        print("Tentativa de gerar receita sem API Key configurada.")
+        raise RecipeGenerationError("API Key do Gemini não configurada no servidor.", 500)
+
+    def call_gemini():
+        with metrics.timer("prompt_build"):
+            prompt = build_recipe_prompt(category, subcategory, ingredients)
         # CORRIGIDO: f-string única
         print(f"Gerando receita com prompt: {prompt[:200]}...") # Log do início do prompt
-        response = model.generate_content(prompt)
+        with metrics.timer("gemini_call"):
+            response = gemini_client.generate(prompt, timeout=timeout)
 
         # Verifica se a resposta foi bloqueada
         if not response.parts:
+             metrics.inc("gemini_blocked_responses_total")
              block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Não especificado"
              # CORRIGIDO: f-string única
              print(f"Resposta bloqueada pela API Gemini. Razão: {block_reason}")
-             # CORRIGIDO: f-string única
-             return jsonify({"error": f"A geração da receita foi bloqueada por políticas de segurança. Razão: {block_reason}"}), 400
-
-        recipe_text = response.text
-        recipe_title = extract_title(recipe_text)
-        # Cria um ID mais robusto e único
-        recipe_id = f"{category.replace(' ', '_')}_{subcategory.replace(' ', '_') if subcategory else 'Geral'}_{int(datetime.now().timestamp() * 1000)}"
-
-        recipe_data = {
-            "id": recipe_id,
-            "title": recipe_title,
-            "category": category,
-            "subcategory": subcategory if subcategory else "Geral",
-            "full_text": recipe_text,
-            "is_favorite": False # Inicialmente não é favorito
-        }
-
-        if add_recipe_to_db(category, subcategory, recipe_data):
-             # CORRIGIDO: Usar f-string única
-             print(f"Receita '{recipe_title}' adicionada a {category}/{recipe_data['subcategory']}")
+             raise RecipeGenerationError(f"A geração da receita foi bloqueada por políticas de segurança. Razão: {block_reason}", 400)
+        return response.text
+
+    def save(recipe_text):
+        recipe_data = save_generated_recipe(category, subcategory, recipe_text, cache_key)
+        if recipe_data is None:
+             raise RecipeGenerationError("Falha ao salvar a receita gerada internamente.", 500)
+        return recipe_data
+
+    try:
+        if coalesce == "shared":
+            recipe_data, shared = coalesced(("shared", cache_key), lambda: save(call_gemini()), timeout)
+        elif coalesce == "separate":
+            recipe_text, shared = coalesced(("separate", cache_key), call_gemini, timeout)
+            recipe_data = save(recipe_text)
         else:
-             # A função add_recipe_to_db já imprime o erro
-             return jsonify({"error": "Falha ao salvar a receita gerada internamente."}), 500
+            recipe_data, shared = save(call_gemini()), False
+    except GeminiUnavailableError as e:
+        fallback = degraded_recipe(category, subcategory, ingredients, cache_key) if GEMINI_DEGRADED_FALLBACK else None
+        if fallback is None:
+            raise
+        recipe_data, from_cache = fallback
+        metrics.inc("gemini_degraded_responses_total")
+        print(f"Gemini indisponível ({e.message}). Servindo receita existente: {recipe_data['title']}")
+        return recipe_data, generation_info(cached=from_cache, degraded=True)
+    return recipe_data, generation_info(coalesced=shared)
+
+@app.route("/generate_recipe", methods=["POST"])
+@login_required
+def generate_recipe_route():
+    data = request.get_json(silent=True)
+    category, subcategory, ingredients, error = validate_generation_request(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-        return jsonify(recipe_data)
+    try:
+        coalesce = parse_coalesce_mode(data.get("coalesce"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    try:
+        recipe_data, info = generate_recipe(category, subcategory, ingredients, use_cache=data.get("use_cache", True) is not False,
+                                            coalesce=coalesce, use_pool=data.get("use_pool", True) is not False)
+        return jsonify({**recipe_data, **info, "upstream": gemini_client.upstream_state()})
+    except GeminiUnavailableError as e:
+        return upstream_unavailable_response(e)
+    except RecipeGenerationError as e:
+        return jsonify({"error": e.message}), e.status_code
     except Exception as e:
+        metrics.inc("app_errors_total", stage="generate_recipe")
         # CORRIGIDO: Usar f-string única
         print(f"Erro ao chamar a API Gemini ou processar a resposta: {e}\n{traceback.format_exc()}")
         return jsonify({"error": "Falha ao gerar ou processar a receita. Verifique os logs do servidor."}), 500
 
+# --- Geração de Receitas em Lote ---
+# Pool compartilhado: limita o total de chamadas simultâneas ao Gemini feitas por lotes neste processo
+# Um lote com toda a taxonomia roda em uma única rodada: leva o tempo da chamada mais lenta (se GEMINI_BURST permitir)
+RECIPE_BATCH_MAX_WORKERS = int(os.getenv("RECIPE_BATCH_MAX_WORKERS", str(RECIPE_TAXONOMY_SIZE)))
+RECIPE_BATCH_MAX_ITEMS = int(os.getenv("RECIPE_BATCH_MAX_ITEMS", "50"))
+RECIPE_BATCH_ITEM_TIMEOUT = float(os.getenv("RECIPE_BATCH_ITEM_TIMEOUT", "60"))
+batch_executor = ThreadPoolExecutor(max_workers=RECIPE_BATCH_MAX_WORKERS, thread_name_prefix="recipe-batch")
+
+def generate_batch_item(index, spec, use_cache, use_pool):
+    category, subcategory, ingredients, error = validate_generation_request(spec if isinstance(spec, dict) else None)
+    if error:
+        return {"index": index, "ok": False, "status": 400, "error": error}
+    try:
+        coalesce = parse_coalesce_mode(spec.get("coalesce"))
+    except ValueError as e:
+        return {"index": index, "ok": False, "status": 400, "error": str(e)}
+    try:
+        # Novas tentativas com backoff ficam a cargo do gemini_client
+        recipe_data, info = generate_recipe(category, subcategory, ingredients, use_cache=use_cache,
+                                            timeout=RECIPE_BATCH_ITEM_TIMEOUT, coalesce=coalesce, use_pool=use_pool)
+        return {"index": index, "ok": True, **info, "recipe": recipe_data}
+    except (RecipeGenerationError, GeminiUnavailableError) as e:
+        return {"index": index, "ok": False, "status": e.status_code, "error": e.message}
+    except Exception as e:
+        metrics.inc("app_errors_total", stage="batch")
+        print(f"Erro no item {index} do lote: {e}\n{traceback.format_exc()}")
+        return {"index": index, "ok": False, "status": 500, "error": "Falha ao gerar ou processar a receita. Verifique os logs do servidor."}
+
+@app.route("/generate_recipes/batch", methods=["POST"])
+@login_required
+def generate_recipes_batch_route():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list) or not data["items"]:
+        return jsonify({"error": "Envie uma lista não vazia em 'items'."}), 400
+    items = data["items"]
+    if len(items) > RECIPE_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Máximo de {RECIPE_BATCH_MAX_ITEMS} itens por lote."}), 400
+
+    use_cache = data.get("use_cache", True) is not False
+    use_pool = data.get("use_pool", True) is not False
+    started_at = time.monotonic()
+    futures = [batch_executor.submit(generate_batch_item, index, spec, use_cache, use_pool) for index, spec in enumerate(items)]
+    results = [future.result() for future in futures]
+    succeeded = sum(1 for result in results if result["ok"])
+    print(f"Lote concluído: {succeeded}/{len(results)} receitas em {time.monotonic() - started_at:.1f}s")
+    return jsonify({
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_ms": int((time.monotonic() - started_at) * 1000),
+        "upstream": gemini_client.upstream_state(),
+    })
+
+# --- Rota de Geração com Streaming (Server-Sent Events) ---
+def sse_event(event, payload):
+    # Formato SSE: cada evento termina com uma linha em branco
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route("/generate_recipe/stream", methods=["POST"])
+@login_required
+def generate_recipe_stream_route():
+    data = request.get_json(silent=True)
+    category, subcategory, ingredients, error = validate_generation_request(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    use_cache = data.get("use_cache", True) is not False
+    use_pool = data.get("use_pool", True) is not False and not ingredients
+    cache_key = make_recipe_cache_key(category, subcategory, ingredients)
+    cached_recipe = recipe_cache.get(cache_key) if use_cache else None
+    with metrics.timer("prompt_build"):
+        prompt = build_recipe_prompt(category, subcategory, ingredients)
+
+    def event_stream():
+        # Evento inicial enviado imediatamente: o navegador recebe o primeiro byte antes da resposta do Gemini
+        yield sse_event("start", {"category": category, "subcategory": subcategory or "Geral"})
+        pooled_recipe = take_pooled_recipe(category, subcategory, cache_key) if use_pool else None
+        if pooled_recipe is not None:
+            yield sse_event("chunk", {"text": pooled_recipe["full_text"]})
+            yield sse_event("done", {**pooled_recipe, **generation_info(pooled=True)})
+            return
+        if cached_recipe is not None:
+            print(f"Receita servida do cache (stream): {cached_recipe['title']}")
+            yield sse_event("chunk", {"text": cached_recipe["full_text"]})
+            yield sse_event("done", {**cached_recipe, **generation_info(cached=True)})
+            return
+        # Como em generate_recipe: sem API Key, só falha quando realmente precisaria chamar o Gemini
+        if API_KEY == "SUA_API_KEY_AQUI":
+            print("Tentativa de gerar receita sem API Key configurada.")
+            yield sse_event("error", {"error": "API Key do Gemini não configurada no servidor."})
+            return
+        text_parts = []
+        try:
+            print(f"Gerando receita (stream) com prompt: {prompt[:200]}...")
+            with metrics.timer("gemini_stream"):
+                response = gemini_client.generate(prompt, stream=True)
+                try:
+                    for chunk in response:
+                        if not chunk.parts:
+                            continue
+                        text_parts.append(chunk.text)
+                        yield sse_event("chunk", {"text": chunk.text})
+                except google_api_exceptions().GoogleAPICallError:
+                    # Falhas no meio do stream também contam para o circuit breaker
+                    gemini_client.breaker.record_failure()
+                    raise
+
+            recipe_text = "".join(text_parts)
+            if not recipe_text:
+                metrics.inc("gemini_blocked_responses_total")
+                block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Não especificado"
+                print(f"Resposta bloqueada pela API Gemini. Razão: {block_reason}")
+                yield sse_event("error", {"error": f"A geração da receita foi bloqueada por políticas de segurança. Razão: {block_reason}"})
+                return
+
+            recipe_data = save_generated_recipe(category, subcategory, recipe_text, cache_key)
+            if recipe_data is None:
+                yield sse_event("error", {"error": "Falha ao salvar a receita gerada internamente."})
+                return
+            yield sse_event("done", {**recipe_data, **generation_info()})
+        except GeminiUnavailableError as e:
+            fallback = degraded_recipe(category, subcategory, ingredients, cache_key) if GEMINI_DEGRADED_FALLBACK else None
+            if fallback is None:
+                yield sse_event("error", {"error": e.message, "upstream": gemini_client.upstream_state()})
+                return
+            recipe_data, from_cache = fallback
+            metrics.inc("gemini_degraded_responses_total")
+            print(f"Gemini indisponível ({e.message}). Servindo receita existente (stream): {recipe_data['title']}")
+            yield sse_event("chunk", {"text": recipe_data["full_text"]})
+            yield sse_event("done", {**recipe_data, **generation_info(cached=from_cache, degraded=True), "upstream": gemini_client.upstream_state()})
+        except Exception as e:
+            metrics.inc("app_errors_total", stage="generate_recipe_stream")
+            print(f"Erro durante o streaming da API Gemini: {e}\n{traceback.format_exc()}")
+            yield sse_event("error", {"error": "Falha ao gerar ou processar a receita. Verifique os logs do servidor."})
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        # Desativa caches e buffers de proxy (ex.: nginx) para que os eventos cheguem assim que gerados
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/cache/stats", methods=["GET"])
+@login_required
+def get_cache_stats():
+    return jsonify(recipe_cache.stats())
+
 # --- Rotas para Listar Categorias e Receitas ---
+class CategoriesResponseCache:
+    """Corpos JSON de /categories pré-serializados, remontados só quando a versão do catálogo muda."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._snapshot = (None, {}) # (versão do catálogo, {com_contagens: (corpo, etag)})
+
+    def _build(self):
+        counts = self.store.counts()
+        structured_categories = {}
+        for cat in self.store.categories:
+            # Inclui subcategorias que têm receitas ou são 'Geral'
+            valid_subcategories = [sub for sub in self.store.subcategories(cat) if sub == "Geral" or counts.get((cat, sub))]
+            if valid_subcategories:
+                 structured_categories[cat] = sorted(valid_subcategories)
+        with_counts = {cat: {sub: counts.get((cat, sub), 0) for sub in subs} for cat, subs in structured_categories.items()}
+        variants = {}
+        for key, payload in ((False, structured_categories), (True, with_counts)):
+            body = app.json.dumps(payload).encode("utf-8") # Mesma serialização do jsonify
+            variants[key] = (body, hashlib.sha256(body).hexdigest()[:32])
+        return variants
+
+    def get(self, with_counts=False):
+        version = self.store.catalog_version()
+        cached_version, variants = self._snapshot
+        if version != cached_version:
+            with self._lock:
+                cached_version, variants = self._snapshot
+                if version != cached_version:
+                    variants = self._build()
+                    self._snapshot = (version, variants)
+        return variants[with_counts]
+
+categories_response_cache = CategoriesResponseCache(recipes_db)
+
 @app.route("/categories", methods=["GET"])
 @login_required
 def get_categories():
-    structured_categories = {}
-    for cat, sub_dict in recipes_db.items():
-        # Inclui subcategorias que têm receitas ou são 'Geral'
-        valid_subcategories = [sub for sub, recipes in sub_dict.items() if recipes or sub == "Geral"]
-        if valid_subcategories:
-             structured_categories[cat] = sorted(valid_subcategories)
-    return jsonify(structured_categories)
+    # ?counts=1 devolve {categoria: {subcategoria: total}} no lugar das listas de nomes
+    body, etag = categories_response_cache.get(with_counts=request.args.get("counts") in ("1", "true"))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def request_favorite_ids():
+    # Favoritos do usuário logado, guardados no servidor; carregados uma vez por requisição
+    if "favorite_ids" not in g:
+        g.favorite_ids = recipes_db.favorite_ids(current_user.get_id())
+    return g.favorite_ids
+
+def request_favorites_of():
+    # ?favorites_only=true restringe a listagem aos favoritos do usuário logado
+    return current_user.get_id() if request.args.get("favorites_only") == "true" else None
+
+# Paginação das listagens: ?limit=N&after=<cursor>&sort=created_at|-created_at&fields=id,title,...
+RECIPES_PAGE_DEFAULT_LIMIT = 50
+RECIPES_PAGE_MAX_LIMIT = 200
+RECIPE_LIST_FIELDS = ("id", "title", "category", "subcategory", "full_text", "is_favorite", "created_at", "excerpt",
+                      "prep_minutes", "ingredients", "steps")
+RECIPES_FILTER_MAX_INGREDIENTS = 10
+
+def encode_recipe_cursor(recipe):
+    return base64.urlsafe_b64encode(f"{recipe.created_ms}:{recipe.id}".encode()).decode().rstrip("=")
+
+def decode_recipe_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_ms, recipe_id = raw.split(":", 1)
+        return int(created_ms), recipe_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Cursor 'after' inválido.")
+
+def parse_listing_args(args, streaming=False):
+    """Lê os parâmetros de paginação da query string. Levanta ValueError com mensagem para o cliente."""
+    # Exportações em streaming não têm limite padrão nem máximo: a memória não cresce com o tamanho da resposta
+    default_limit = None if streaming else RECIPES_PAGE_DEFAULT_LIMIT
+    try:
+        limit = int(args["limit"]) if args.get("limit") else default_limit
+    except ValueError:
+        raise ValueError("'limit' deve ser um número inteiro.")
+    if streaming:
+        if limit is not None and limit < 1:
+            raise ValueError("'limit' deve ser maior que zero.")
+    elif not 1 <= limit <= RECIPES_PAGE_MAX_LIMIT:
+        raise ValueError(f"'limit' deve estar entre 1 e {RECIPES_PAGE_MAX_LIMIT}.")
+    after = decode_recipe_cursor(args["after"]) if args.get("after") else None
+    sort = args.get("sort", "created_at")
+    if sort not in ("created_at", "-created_at"):
+        raise ValueError("'sort' deve ser 'created_at' ou '-created_at'.")
+    fields = None
+    if args.get("fields"):
+        fields = [field.strip() for field in args["fields"].split(",") if field.strip()]
+        unknown = [field for field in fields if field not in RECIPE_LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Campos desconhecidos em 'fields': {', '.join(unknown)}.")
+    return limit, after, sort == "-created_at", fields
+
+def parse_listing_filters(args):
+    """Filtros sobre os campos estruturados: ?max_prep_minutes=N&ingredients=ovo,farinha (todos precisam constar)."""
+    filters = {}
+    if args.get("max_prep_minutes"):
+        try:
+            filters["max_prep_minutes"] = int(args["max_prep_minutes"])
+        except ValueError:
+            raise ValueError("'max_prep_minutes' deve ser um número inteiro.")
+    if args.get("ingredients"):
+        tokens = set()
+        for ingredient in args["ingredients"].split(","):
+            tokens |= ingredient_tokens(ingredient)
+        if not tokens:
+            raise ValueError("'ingredients' não contém nenhum ingrediente válido.")
+        if len(tokens) > RECIPES_FILTER_MAX_INGREDIENTS:
+            raise ValueError(f"Informe no máximo {RECIPES_FILTER_MAX_INGREDIENTS} ingredientes em 'ingredients'.")
+        filters["ingredients"] = tokens
+    return filters
+
+RECIPES_STREAM_BATCH_SIZE = 500
+RECIPES_STREAM_MIMETYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+def requested_stream_format():
+    # ?stream=ndjson|json, ou "Accept: application/x-ndjson" para NDJSON
+    stream_format = request.args.get("stream")
+    if stream_format is None and request.accept_mimetypes.best == RECIPES_STREAM_MIMETYPES["ndjson"]:
+        stream_format = "ndjson"
+    return stream_format
+
+def recipes_stream_response(stream_format, category, subcategory):
+    """Exportação completa em streaming: NDJSON (uma receita por linha) ou um array JSON enviado em partes."""
+    if stream_format not in RECIPES_STREAM_MIMETYPES:
+        return jsonify({"error": "'stream' deve ser 'ndjson' ou 'json'."}), 400
+    try:
+        limit, after, descending, fields = parse_listing_args(request.args, streaming=True)
+        filters = parse_listing_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    favorite_ids = request_favorite_ids()
+    recipes = itertools.islice(
+        recipes_db.iter_recipes(
+            category, subcategory, after=after, descending=descending,
+            batch_size=RECIPES_STREAM_BATCH_SIZE, favorites_of=request_favorites_of(), **filters,
+        ),
+        limit,
+    )
+
+    def generate():
+        if stream_format == "ndjson":
+            for recipe in recipes:
+                yield json.dumps(recipe.to_dict(recipe.id in favorite_ids, fields), ensure_ascii=False) + "\n"
+            return
+        yield "["
+        for index, recipe in enumerate(recipes):
+            yield ("," if index else "") + json.dumps(recipe.to_dict(recipe.id in favorite_ids, fields), ensure_ascii=False)
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype=RECIPES_STREAM_MIMETYPES[stream_format])
+
+def recipes_page_response(category=None, subcategory=None):
+    stream_format = requested_stream_format()
+    if stream_format is not None:
+        return recipes_stream_response(stream_format, category, subcategory)
+    try:
+        limit, after, descending, fields = parse_listing_args(request.args)
+        filters = parse_listing_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Busca um item a mais só para saber se existe próxima página
+    recipes = recipes_db.list_recipes(
+        category, subcategory, limit=limit + 1, after=after, descending=descending, favorites_of=request_favorites_of(), **filters
+    )
+    has_more = len(recipes) > limit
+    recipes = recipes[:limit]
+    favorite_ids = request_favorite_ids()
+    response = jsonify([recipe.to_dict(recipe.id in favorite_ids, fields) for recipe in recipes])
+    if has_more:
+        # O corpo continua sendo uma lista; o cursor da próxima página vai nos cabeçalhos
+        next_cursor = encode_recipe_cursor(recipes[-1])
+        # Parâmetros com o mesmo nome de uma variável da rota (ex.: ?category= em /recipes/<category>) não têm efeito aqui
+        query = {key: values for key, values in request.args.to_dict(flat=False).items() if key not in request.view_args}
+        next_url = url_for(request.endpoint, **request.view_args, **{**query, "after": next_cursor})
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
 
 @app.route("/recipes", methods=["GET"])
 @login_required
 def get_all_recipes():
-    all_recipes = []
-    # Obtém a lista de favoritos do localStorage (passada como query param pelo frontend)
-    favorite_ids = request.args.getlist("favorites[]") # Espera 'favorites[]' do JS
-    for category, subcategories in recipes_db.items():
-        for subcategory, recipes in subcategories.items():
-            for recipe in recipes:
-                 # Cria uma cópia para não modificar o DB original
-                 recipe_copy = recipe.copy()
-                 recipe_copy["is_favorite"] = recipe["id"] in favorite_ids
-                 all_recipes.append(recipe_copy)
-    return jsonify(all_recipes)
+    return recipes_page_response()
 
 @app.route("/recipes/<category>", methods=["GET"])
 @login_required
 def get_recipes_by_category(category):
     if category not in recipes_db:
         return jsonify({"error": "Categoria não encontrada"}), 404
-    all_recipes_in_category = []
-    favorite_ids = request.args.getlist("favorites[]")
-    for sub, recipes in recipes_db[category].items():
-         for recipe in recipes:
-             recipe_copy = recipe.copy()
-             recipe_copy["is_favorite"] = recipe["id"] in favorite_ids
-             all_recipes_in_category.append(recipe_copy)
-    return jsonify(all_recipes_in_category)
+    return recipes_page_response(category)
 
 @app.route("/recipes/<category>/<subcategory>", methods=["GET"])
 @login_required
@@ -380,135 +2497,512 @@ def get_recipes_by_subcategory(category, subcategory):
     if category not in recipes_db:
         return jsonify({"error": "Categoria não encontrada"}), 404
     target_subcategory = subcategory if subcategory else "Geral"
-    favorite_ids = request.args.getlist("favorites[]")
-    recipes_to_return = []
-    if target_subcategory not in recipes_db[category]:
-        if "Geral" in recipes_db[category]:
-             # CORRIGIDO: Usar f-string única
-             print(f"Subcategoria '{target_subcategory}' não encontrada, retornando 'Geral' para '{category}'.")
-             recipes_to_return = recipes_db[category]["Geral"]
-        else:
-             return jsonify({"error": "Subcategoria não encontrada"}), 404
-    else:
-        recipes_to_return = recipes_db[category][target_subcategory]
+    effective_subcategory = recipes_db.resolve_subcategory(category, target_subcategory)
+    if effective_subcategory is None:
+        return jsonify({"error": "Subcategoria não encontrada"}), 404
+    if effective_subcategory != target_subcategory:
+        # CORRIGIDO: Usar f-string única
+        print(f"Subcategoria '{target_subcategory}' não encontrada, retornando 'Geral' para '{category}'.")
+    return recipes_page_response(category, effective_subcategory)
 
-    recipes_processed = []
-    for recipe in recipes_to_return:
-        recipe_copy = recipe.copy()
-        recipe_copy["is_favorite"] = recipe["id"] in favorite_ids
-        recipes_processed.append(recipe_copy)
-    return jsonify(recipes_processed)
+# --- Busca por Título, Texto e Ingredientes ---
+SEARCH_DEFAULT_LIMIT = 20
 
-# --- Rota para Gerar PDF --- #
-@app.route("/generate_pdf", methods=["GET"])
+@app.route("/search", methods=["GET"])
 @login_required
-def generate_pdf_route():
+def search_recipes():
+    # ?q=texto livre e/ou ?ingredients=ovo,farinha: a receita precisa conter todos os termos
+    terms = search_terms(request.args.get("q", ""))
+    for ingredient in request.args.get("ingredients", "").split(","):
+        terms.extend(search_terms(ingredient))
+    if not terms:
+        return jsonify({"error": "Informe 'q' ou 'ingredients' com ao menos um termo de busca (palavras comuns como 'de' ou 'minutos' são ignoradas)."}), 400
     category = request.args.get("category")
-    subcategory = request.args.get("subcategory")
-    recipe_ids = request.args.getlist("ids[]") # Espera 'ids[]' do JS
-    favorites_only = request.args.get("favorites_only") == "true"
-    favorite_ids_for_pdf = request.args.getlist("favorites[]") # IDs favoritos atuais
+    if category and category not in recipes_db:
+        return jsonify({"error": "Categoria não encontrada"}), 404
+    try:
+        limit = int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "'limit' deve ser um número inteiro."}), 400
+    limit = max(1, min(limit, RECIPES_PAGE_MAX_LIMIT))
+    try:
+        fields = parse_listing_args({"fields": request.args.get("fields", "")})[3]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    favorite_ids = request_favorite_ids()
+    results = recipes_db.search(terms, category=category, limit=limit)
+    return jsonify([{**recipe.to_dict(recipe.id in favorite_ids, fields), "score": round(score, 4)} for recipe, score in results])
+
+@app.route("/recipe/<recipe_id>", methods=["GET"])
+@login_required
+def get_recipe(recipe_id):
+    # Detalhe completo (com full_text) para listagens que usam ?fields= sem o texto
+    recipe = recipes_db.get(recipe_id)
+    if recipe is None:
+        return jsonify({"error": "Receita não encontrada"}), 404
+    return jsonify(recipe.to_dict(recipe.id in request_favorite_ids()))
+
+# --- Favoritos (por usuário, no servidor) ---
+FAVORITES_SYNC_MAX_IDS = int(os.getenv("FAVORITES_SYNC_MAX_IDS", "5000"))
+
+@app.route("/favorites", methods=["GET"])
+@login_required
+def get_favorites():
+    favorite_ids = sorted(request_favorite_ids())
+    return jsonify({"ids": favorite_ids, "count": len(favorite_ids)})
+
+@app.route("/favorites/<recipe_id>", methods=["PUT"])
+@login_required
+def add_favorite(recipe_id):
+    if recipes_db.get(recipe_id) is None:
+        return jsonify({"error": "Receita não encontrada"}), 404
+    recipes_db.add_favorites(current_user.get_id(), [recipe_id])
+    return jsonify({"id": recipe_id, "is_favorite": True})
+
+@app.route("/favorites/<recipe_id>", methods=["DELETE"])
+@login_required
+def remove_favorite(recipe_id):
+    recipes_db.remove_favorite(current_user.get_id(), recipe_id)
+    return jsonify({"id": recipe_id, "is_favorite": False})
+
+@app.route("/favorites/sync", methods=["POST"])
+@login_required
+def sync_favorites():
+    # Migração única dos favoritos antigos do localStorage: une os IDs enviados aos já salvos
+    data = request.get_json(silent=True) or {}
+    recipe_ids = data.get("ids")
+    if not isinstance(recipe_ids, list) or not all(isinstance(recipe_id, str) for recipe_id in recipe_ids):
+        return jsonify({"error": "'ids' deve ser uma lista de IDs de receitas."}), 400
+    if len(recipe_ids) > FAVORITES_SYNC_MAX_IDS:
+        return jsonify({"error": f"Envie no máximo {FAVORITES_SYNC_MAX_IDS} IDs por vez."}), 400
+    added = recipes_db.add_favorites(current_user.get_id(), recipe_ids)
+    favorite_ids = sorted(recipes_db.favorite_ids(current_user.get_id()))
+    # Ignorados são só os IDs que não existem no catálogo (os que já eram favoritos não contam)
+    unknown = len(set(recipe_ids)) - len(recipes_db.get_many(recipe_ids))
+    return jsonify({
+        "ids": favorite_ids,
+        "count": len(favorite_ids),
+        "added": added,
+        "ignored": unknown,
+    })
+
+# --- Geração de PDF: cache de livros prontos e de receitas já diagramadas --- #
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(APP_DATA_DIR, "pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# Receitas diagramadas de uma vez: só um trecho de layouts fica vivo; os trechos são juntados com pypdf
+PDF_RENDER_CHUNK_SIZE = int(os.getenv("PDF_RENDER_CHUNK_SIZE", "50"))
+# A diagramação fica em src/pdf_render.py; neste processo, com importação sob demanda registrada e métricas
+pdf_render.configure(import_module=heavy_import, timer=metrics.timer)
+
+class PdfFileCache:
+    """Cache em disco de PDFs prontos, endereçado pelo conteúdo e limitado em bytes (remove os menos usados)."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(title, recipe_ids):
+        payload = json.dumps([pdf_render.PDF_LAYOUT_VERSION, title, list(recipe_ids)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            os.utime(path) # Atualiza o mtime: usado como "último acesso" na remoção LRU
+        except FileNotFoundError:
+            return None
+        return path
+
+    @contextmanager
+    def writing(self, key):
+        """Arquivo temporário que vira a entrada `key` ao final do bloco: o PDF vai direto para o disco, não para a memória."""
+        path = self.path_for(key)
+        # Escrita atômica: outro worker nunca lê um PDF pela metade
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._evict(keep=path)
+
+    def put(self, key, pdf_bytes):
+        with self.writing(key) as f:
+            f.write(pdf_bytes)
+        return self.path_for(key)
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep: # Acabou de ser escrito e ainda vai ser enviado
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+pdf_file_cache = PdfFileCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+
+metrics.describe("pdf_layout_cache_events_total", "counter", "Acessos ao cache de receitas já diagramadas (hit/miss).")
+metrics.describe("pdf_layout_cache_bytes", "gauge", "Memória estimada do cache de receitas já diagramadas neste processo.")
+metrics.register_collector(lambda: [
+    ("pdf_layout_cache_events_total", {"event": "hit"}, pdf_render.rendered_recipe_cache.hits),
+    ("pdf_layout_cache_events_total", {"event": "miss"}, pdf_render.rendered_recipe_cache.misses),
+    ("pdf_layout_cache_bytes", {}, pdf_render.rendered_recipe_cache.estimated_bytes),
+])
+
+def write_cookbook_pdf(pdf_title, recipes, target):
+    """Escreve o livro inteiro em `target`, diagramando PDF_RENDER_CHUNK_SIZE receitas por vez.
+
+    Cada trecho vira um arquivo de parte e seus layouts são descartados antes do próximo: o pico de memória
+    não cresce com o catálogo. Sem pypdf para juntar as partes, o livro é diagramado de uma vez.
+    """
+    if not PYPDF_AVAILABLE or len(recipes) <= PDF_RENDER_CHUNK_SIZE:
+        pdf_render.render_cookbook_pdf(pdf_title, recipes, target=target)
+        return
+    with tempfile.TemporaryDirectory(dir=PDF_CACHE_DIR, prefix="parts-") as parts_dir:
+        part_paths = []
+        for index, start in enumerate(range(0, len(recipes), PDF_RENDER_CHUNK_SIZE)):
+            part_path = os.path.join(parts_dir, f"part{index}.pdf")
+            with open(part_path, "wb") as part:
+                pdf_render.render_cookbook_pdf(pdf_title, recipes[start:start + PDF_RENDER_CHUNK_SIZE], include_cover=index == 0, target=part)
+            part_paths.append(part_path)
+        with metrics.timer("pdf_write"):
+            pdf_render.merge_pdf_chunks(part_paths, target)
+
+def select_pdf_recipes(args):
+    """Resolve os filtros do PDF. Retorna (título, receitas, erro) — erro é uma mensagem para resposta 400."""
+    category = args.get("category")
+    subcategory = args.get("subcategory")
+    recipe_ids = args.getlist("ids[]") # Espera 'ids[]' do JS
+    favorites_only = args.get("favorites_only") == "true"
 
     recipes_to_include = []
     pdf_title = "Meu Livro de Receitas"
 
-    # Coleta todas as receitas primeiro para facilitar a filtragem por ID ou favoritos
-    all_recipes_flat = []
-    for cat_dict in recipes_db.values():
-        for sub_list in cat_dict.values():
-            all_recipes_flat.extend(sub_list)
-
     if favorites_only:
-        if not favorite_ids_for_pdf:
-             return jsonify({"error": "Nenhum ID de receita favorito fornecido para gerar o PDF."}), 400
+        # Favoritos salvos no servidor para o usuário logado
+        recipes_to_include = recipes_db.list_recipes(favorites_of=current_user.get_id())
+        if not recipes_to_include:
+             return pdf_title, [], "Nenhuma receita favorita salva para gerar o PDF."
         pdf_title = "Minhas Receitas Favoritas"
-        recipes_to_include = [r for r in all_recipes_flat if r["id"] in favorite_ids_for_pdf]
 
     elif recipe_ids:
         pdf_title = "Seleção de Receitas"
-        recipes_to_include = [r for r in all_recipes_flat if r["id"] in recipe_ids]
+        recipes_to_include = recipes_db.get_many(recipe_ids)
 
     elif category and category != "all":
         pdf_title = f"Receitas de {category}"
-        if subcategory and subcategory != "all":
-            pdf_title += f" - {subcategory}"
-            if category in recipes_db and subcategory in recipes_db[category]:
-                recipes_to_include = recipes_db[category][subcategory]
-            elif category in recipes_db and "Geral" in recipes_db[category]:
-                 recipes_to_include = recipes_db[category]["Geral"]
-        else: # Todas as subcategorias da categoria
-            if category in recipes_db:
-                for sub_list in recipes_db[category].values():
-                    recipes_to_include.extend(sub_list)
+        if category in recipes_db:
+            if subcategory and subcategory != "all":
+                pdf_title += f" - {subcategory}"
+                recipes_to_include = recipes_db.list_recipes(category, recipes_db.resolve_subcategory(category, subcategory))
+            else: # Todas as subcategorias da categoria
+                recipes_to_include = recipes_db.list_recipes(category)
     else: # Todas as receitas
         pdf_title = "Todas as Receitas"
-        recipes_to_include = all_recipes_flat
+        recipes_to_include = recipes_db.list_recipes()
+    return pdf_title, recipes_to_include, None
+
+def pdf_download_name(pdf_title):
+    return re.sub(r'[^\w\- ]+', '', pdf_title).replace(' ', '_') + ".pdf"
 
+# --- Rota para Gerar PDF --- #
+@app.route("/generate_pdf", methods=["GET"])
+@login_required
+def generate_pdf_route():
+    pdf_title, recipes_to_include, error = select_pdf_recipes(request.args)
+    if error:
+        return jsonify({"error": error}), 400
     if not recipes_to_include:
         return jsonify({"error": "Nenhuma receita encontrada para gerar o PDF com os filtros fornecidos."}), 404
 
-    # Gera o HTML para o PDF
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset=\"UTF-8\">
-        <title>{pdf_title}</title>
-        <style>
-            @page {{ margin: 2cm; }}
-            body {{ font-family: 'Helvetica', 'Arial', sans-serif; line-height: 1.5; color: #333; }}
-            h1 {{ text-align: center; color: #4CAF50; border-bottom: 2px solid #ddd; padding-bottom: 10px; margin-bottom: 1.5cm; }}
-            .recipe {{ page-break-inside: avoid; margin-bottom: 2cm; border-top: 1px solid #eee; padding-top: 1cm; }}
-            h2 {{ color: #333; margin-bottom: 0.5cm; border-bottom: 1px solid #eee; padding-bottom: 5px; }}
-            p.category-info {{ font-style: italic; color: #777; margin-bottom: 1cm; font-size: 0.9em; }}
-            pre {{ 
-                white-space: pre-wrap; /* Mantém quebras de linha e espaços */
-                word-wrap: break-word; /* Quebra palavras longas */
-                background-color: #f9f9f9; 
-                padding: 15px; 
-                border-radius: 5px; 
-                border: 1px solid #eee; 
-                font-family: 'Courier New', Courier, monospace; /* Fonte monoespaçada */
-                font-size: 0.9em;
-                line-height: 1.6;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1>{pdf_title}</h1>
-    """
-    for recipe in recipes_to_include:
-        # Limpa um pouco o título para o nome do arquivo
-        safe_title = re.sub(r'[^\w\- ]+', '', recipe["title"]).replace(' ', '_') # Mantém espaços e hífens, substitui outros por nada
-        html_content += f"""
-        <div class=\"recipe\">
-            <h2>{recipe["title"]}</h2>
-            <p class=\"category-info\"><i>Categoria: {recipe["category"]} / {recipe["subcategory"]}</i></p>
-            <pre>{recipe["full_text"]}</pre>
-        </div>
-        """
-    html_content += "</body></html>"
-
     try:
-        # Gera o PDF usando WeasyPrint
-        pdf_bytes = HTML(string=html_content).write_pdf()
-        
-        # Cria a resposta Flask
-        response = make_response(pdf_bytes)
-        response.headers["Content-Type"] = "application/pdf"
-        # Nome do arquivo para download
-        safe_pdf_title = re.sub(r'[^\w\- ]+', '', pdf_title).replace(' ', '_')
-        response.headers["Content-Disposition"] = f"attachment; filename=\"{safe_pdf_title}.pdf\""
-        # CORRIGIDO: f-string única
-        print(f"Gerando PDF: {safe_pdf_title}.pdf")
-        return response
+        cache_key = pdf_file_cache.make_key(pdf_title, [recipe.id for recipe in recipes_to_include])
+        pdf_path = pdf_file_cache.get(cache_key)
+        if pdf_path:
+            print(f"PDF servido do cache: {pdf_download_name(pdf_title)}")
+        else:
+            # Gera o PDF usando WeasyPrint, escrevendo direto no arquivo do cache
+            with pdf_file_cache.writing(cache_key) as pdf_file:
+                write_cookbook_pdf(pdf_title, recipes_to_include, pdf_file)
+            pdf_path = pdf_file_cache.path_for(cache_key)
+            # CORRIGIDO: f-string única
+            print(f"Gerando PDF: {pdf_download_name(pdf_title)}")
+        # Enviado do disco em blocos (sendfile no gunicorn), sem carregar o PDF na memória
+        return send_file(pdf_path, mimetype="application/pdf", as_attachment=True, download_name=pdf_download_name(pdf_title))
 
     except Exception as e:
+        metrics.inc("app_errors_total", stage="pdf")
         # CORRIGIDO: Usar f-string única
         print(f"Erro ao gerar PDF com WeasyPrint: {e}\n{traceback.format_exc()}")
         return jsonify({"error": "Falha ao gerar o arquivo PDF."}), 500
 
 
+# --- Jobs de PDF em Segundo Plano (pool de processos) --- #
+# A renderização é CPU-bound: roda em processos separados para não bloquear os workers HTTP.
+# O estado de cada job fica em arquivo JSON, então qualquer worker do gunicorn responde à consulta.
+PDF_JOBS_DIR = os.path.join(APP_DATA_DIR, "pdf_jobs")
+PDF_JOB_PROCESSES = int(os.getenv("PDF_JOB_PROCESSES", str(os.cpu_count() or 1)))
+PDF_JOB_CHUNK_SIZE = int(os.getenv("PDF_JOB_CHUNK_SIZE", str(PDF_RENDER_CHUNK_SIZE))) # Receitas por parte renderizada em paralelo
+PDF_JOB_TTL_SECONDS = int(os.getenv("PDF_JOB_TTL_SECONDS", str(24 * 3600)))
+# Sinal de vida: o worker que coordena um job toca o arquivo dele a cada PDF_JOB_HEARTBEAT_SECONDS.
+# Um job na fila ou em andamento sem sinal há PDF_JOB_STALE_SECONDS perdeu o worker (reinício, OOM) e vira erro
+PDF_JOB_HEARTBEAT_SECONDS = float(os.getenv("PDF_JOB_HEARTBEAT_SECONDS", "10"))
+PDF_JOB_STALE_SECONDS = float(os.getenv("PDF_JOB_STALE_SECONDS", "120"))
+PDF_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+os.makedirs(PDF_JOBS_DIR, exist_ok=True)
+
+_pdf_process_pool = None
+_pdf_process_pool_lock = threading.Lock()
+# Threads leves que só coordenam cada job (enviam partes, acompanham o progresso e juntam o resultado)
+pdf_job_coordinator = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf-job")
+_active_pdf_job_ids = set() # Jobs deste processo ainda na fila ou em andamento
+_active_pdf_jobs_lock = threading.Lock()
+_pdf_job_heartbeat_pid = None
+
+def get_pdf_process_pool():
+    # Criado sob demanda e com "spawn": fork de um processo com threads (gthread) não é seguro
+    global _pdf_process_pool
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is None:
+            _pdf_process_pool = ProcessPoolExecutor(
+                max_workers=PDF_JOB_PROCESSES, mp_context=multiprocessing.get_context("spawn"),
+                initializer=pdf_render.init_render_process,
+                initargs=(pdf_render.PDF_LAYOUT_CACHE_MAX_BYTES // max(PDF_JOB_PROCESSES, 1),),
+            )
+        return _pdf_process_pool
+
+def discard_pdf_process_pool(broken_pool):
+    # Um renderizador que morre (ex.: OOM) inutiliza o executor inteiro: o próximo job cria um pool novo
+    global _pdf_process_pool
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is broken_pool:
+            _pdf_process_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def pdf_job_path(job_id):
+    return os.path.join(PDF_JOBS_DIR, f"{job_id}.json")
+
+def ensure_pdf_job_heartbeat():
+    # Uma thread por processo, iniciada no primeiro job (nada de threads no import nem no master do gunicorn)
+    global _pdf_job_heartbeat_pid
+    with _active_pdf_jobs_lock:
+        if _pdf_job_heartbeat_pid == os.getpid():
+            return
+        _pdf_job_heartbeat_pid = os.getpid()
+    threading.Thread(target=pdf_job_heartbeat, name="pdf-job-heartbeat", daemon=True).start()
+
+def pdf_job_heartbeat():
+    # Só atualiza o mtime: o JSON continua sendo escrito apenas pela thread coordenadora do job
+    while True:
+        time.sleep(PDF_JOB_HEARTBEAT_SECONDS)
+        with _active_pdf_jobs_lock:
+            job_ids = list(_active_pdf_job_ids)
+        for job_id in job_ids:
+            try:
+                os.utime(pdf_job_path(job_id))
+            except FileNotFoundError:
+                pass
+
+def write_pdf_job(job):
+    job["updated_at"] = time.time()
+    fd, tmp_path = tempfile.mkstemp(dir=PDF_JOBS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp_path, pdf_job_path(job["id"]))
+
+def read_pdf_job(job_id):
+    if not PDF_JOB_ID_RE.match(job_id):
+        return None
+    try:
+        with open(pdf_job_path(job_id), encoding="utf-8") as f:
+            job = json.load(f)
+            last_seen = max(job.get("updated_at", 0), os.fstat(f.fileno()).st_mtime)
+    except FileNotFoundError:
+        return None
+    if job["status"] in ("queued", "running") and time.time() - last_seen > PDF_JOB_STALE_SECONDS:
+        # Sem sinal de vida: o worker que coordenava o job não existe mais e ninguém vai concluí-lo
+        job.update(status="error", error="A geração do PDF foi interrompida. Tente novamente.")
+    return job
+
+def purge_expired_pdf_jobs():
+    cutoff = time.time() - PDF_JOB_TTL_SECONDS
+    for entry in os.scandir(PDF_JOBS_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def run_pdf_job(job, recipes):
+    """Coordena um job: renderiza as partes em paralelo no pool de processos e junta o resultado no cache."""
+    pool = None
+    try:
+        # Sem pypdf não há como juntar partes: o livro é renderizado de uma vez
+        chunk_size = PDF_JOB_CHUNK_SIZE if PYPDF_AVAILABLE else len(recipes)
+        chunks = [recipes[start:start + chunk_size] for start in range(0, len(recipes), chunk_size)]
+        job.update(status="running", total_chunks=len(chunks))
+        write_pdf_job(job)
+
+        pool = get_pdf_process_pool()
+        part_paths = [os.path.join(PDF_JOBS_DIR, f"{job['id']}.part{index}.pdf") for index in range(len(chunks))]
+        futures = [
+            pool.submit(pdf_render.render_pdf_chunk, job["title"], [pdf_render.pdf_recipe(recipe) for recipe in chunk], index == 0, part_paths[index])
+            for index, chunk in enumerate(chunks)
+        ]
+        for future in as_completed(futures):
+            future.result()
+            job["done_chunks"] += 1
+            job["progress"] = round(job["done_chunks"] / len(chunks), 3)
+            write_pdf_job(job)
+
+        with pdf_file_cache.writing(job["cache_key"]) as pdf_file:
+            if len(part_paths) == 1:
+                with open(part_paths[0], "rb") as part:
+                    shutil.copyfileobj(part, pdf_file)
+            else:
+                pdf_render.merge_pdf_chunks(part_paths, pdf_file)
+        job.update(status="done", progress=1.0)
+        print(f"Job de PDF {job['id']} concluído: {len(recipes)} receitas em {len(chunks)} partes.")
+    except BrokenProcessPool as e:
+        metrics.inc("app_errors_total", stage="pdf_job")
+        print(f"Erro no job de PDF {job['id']}: processo de renderização encerrado inesperadamente ({e}). Recriando o pool.")
+        if pool is not None:
+            discard_pdf_process_pool(pool)
+        job.update(status="error", error="Falha ao gerar o arquivo PDF.")
+    except Exception as e:
+        metrics.inc("app_errors_total", stage="pdf_job")
+        print(f"Erro no job de PDF {job['id']}: {e}\n{traceback.format_exc()}")
+        job.update(status="error", error="Falha ao gerar o arquivo PDF.")
+    finally:
+        for index in range(job.get("total_chunks", 0)):
+            try:
+                os.remove(os.path.join(PDF_JOBS_DIR, f"{job['id']}.part{index}.pdf"))
+            except FileNotFoundError:
+                pass
+    write_pdf_job(job)
+    with _active_pdf_jobs_lock:
+        _active_pdf_job_ids.discard(job["id"])
+
+def pdf_job_public(job):
+    public = {key: job[key] for key in ("id", "status", "progress", "done_chunks", "total_chunks", "title", "recipe_count")}
+    public["status_url"] = url_for("get_pdf_job", job_id=job["id"])
+    if job["status"] == "done":
+        public["download_url"] = url_for("download_pdf_job", job_id=job["id"])
+    if job.get("error"):
+        public["error"] = job["error"]
+    return public
+
+def pdf_job_request_params():
+    # Aceita os mesmos filtros de /generate_pdf, na query string, em formulário ou em JSON
+    if not request.is_json:
+        return request.values
+    params = MultiDict()
+    for key, value in (request.get_json(silent=True) or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            params.add(key, str(item).lower() if isinstance(item, bool) else str(item))
+    return params
+
+@app.route("/pdf_jobs", methods=["POST"])
+@login_required
+def create_pdf_job():
+    pdf_title, recipes_to_include, error = select_pdf_recipes(pdf_job_request_params())
+    if error:
+        return jsonify({"error": error}), 400
+    if not recipes_to_include:
+        return jsonify({"error": "Nenhuma receita encontrada para gerar o PDF com os filtros fornecidos."}), 404
+
+    purge_expired_pdf_jobs()
+    cache_key = pdf_file_cache.make_key(pdf_title, [recipe.id for recipe in recipes_to_include])
+    job = {
+        "id": uuid.uuid4().hex,
+        "user_id": current_user.get_id(),
+        "status": "queued",
+        "progress": 0.0,
+        "done_chunks": 0,
+        "total_chunks": 0,
+        "title": pdf_title,
+        "recipe_count": len(recipes_to_include),
+        "cache_key": cache_key,
+        "created_at": time.time(),
+    }
+    if pdf_file_cache.get(cache_key):
+        # Livro idêntico já renderizado: o job nasce concluído
+        job.update(status="done", progress=1.0)
+        write_pdf_job(job)
+    else:
+        write_pdf_job(job)
+        with _active_pdf_jobs_lock:
+            _active_pdf_job_ids.add(job["id"])
+        ensure_pdf_job_heartbeat()
+        pdf_job_coordinator.submit(run_pdf_job, job, recipes_to_include)
+    response = jsonify(pdf_job_public(job))
+    response.status_code = 202
+    response.headers["Location"] = url_for("get_pdf_job", job_id=job["id"])
+    return response
+
+def load_user_pdf_job(job_id):
+    job = read_pdf_job(job_id)
+    if job is None or job.get("user_id") != current_user.get_id():
+        return None
+    return job
+
+@app.route("/pdf_jobs/<job_id>", methods=["GET"])
+@login_required
+def get_pdf_job(job_id):
+    job = load_user_pdf_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job de PDF não encontrado."}), 404
+    return jsonify(pdf_job_public(job))
+
+@app.route("/pdf_jobs/<job_id>/download", methods=["GET"])
+@login_required
+def download_pdf_job(job_id):
+    job = load_user_pdf_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job de PDF não encontrado."}), 404
+    if job["status"] != "done":
+        return jsonify({"error": "O PDF ainda não está pronto.", **pdf_job_public(job)}), 409
+    pdf_path = pdf_file_cache.get(job["cache_key"])
+    if pdf_path is None:
+        return jsonify({"error": "O PDF expirou do cache. Crie um novo job."}), 410
+    return send_file(pdf_path, mimetype="application/pdf", as_attachment=True, download_name=pdf_download_name(job["title"]))
+
+
+# --- Relatório de Importação ---
+metrics.describe("app_import_seconds", "gauge", "Tempo de importação do app e de cada dependência pesada já carregada neste processo.")
+if PRELOAD_HEAVY_IMPORTS:
+    warm_heavy_imports()
+MODULE_IMPORT_SECONDS = time.perf_counter() - MODULE_IMPORT_STARTED
+metrics.register_collector(lambda: [
+    ("app_import_seconds", {"module": __name__}, round(MODULE_IMPORT_SECONDS, 6)),
+    *(("app_import_seconds", {"module": module_name}, round(seconds, 6)) for module_name, seconds in import_timings.items()),
+])
+_deferred_modules = [module_name for module_name in HEAVY_MODULES if module_name not in _heavy_modules]
+print(f"App importado em {MODULE_IMPORT_SECONDS * 1000:.0f} ms (pid {os.getpid()})"
+      + (f"; adiados até o primeiro uso: {', '.join(_deferred_modules)}." if _deferred_modules else "."))
+
 if __name__ == "__main__":
     # Executa o app Flask
     # debug=False é importante para produção, mas pode ser True para desenvolvimento
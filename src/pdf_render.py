@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Diagramação dos livros de receitas em PDF (WeasyPrint).
+
+Módulo separado do app Flask de propósito: os processos do pool de renderização (spawn) importam só
+este arquivo, sem reabrir o SQLite, rodar migrações ou recompilar as páginas do app a cada processo.
+As receitas chegam como PdfRecipe (tupla simples), então nada de src.main é importado ao desserializá-las.
+"""
+import hashlib
+import html
+import importlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import nullcontext
+
+PDF_FRAGMENT_CACHE_SIZE = int(os.getenv("PDF_FRAGMENT_CACHE_SIZE", "500"))
+# Orçamento de memória do cache de diagramação, por processo (o pool de renderização divide o total entre os seus)
+PDF_LAYOUT_CACHE_MAX_BYTES = int(os.getenv("PDF_LAYOUT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Estimativa do tamanho de um Document: a árvore de layout (caixas, textos do Pango) ocupa ~100x o HTML de origem
+PDF_LAYOUT_BYTES_PER_HTML_BYTE = 100
+PDF_LAYOUT_VERSION = "3" # Altere ao mudar o HTML/CSS do PDF para invalidar o cache em disco
+
+PDF_STYLE = """
+    @page { margin: 2cm; }
+    body { font-family: 'Helvetica', 'Arial', sans-serif; line-height: 1.5; color: #333; }
+    h1 { text-align: center; color: #4CAF50; border-bottom: 2px solid #ddd; padding-bottom: 10px; margin-bottom: 1.5cm; }
+    .recipe { page-break-inside: avoid; margin-bottom: 2cm; padding-top: 1cm; }
+    h2 { color: #333; margin-bottom: 0.5cm; border-bottom: 1px solid #eee; padding-bottom: 5px; }
+    p.category-info { font-style: italic; color: #777; margin-bottom: 1cm; font-size: 0.9em; }
+    pre {
+        white-space: pre-wrap; /* Mantém quebras de linha e espaços */
+        word-wrap: break-word; /* Quebra palavras longas */
+        background-color: #f9f9f9;
+        padding: 15px;
+        border-radius: 5px;
+        border: 1px solid #eee;
+        font-family: 'Courier New', Courier, monospace; /* Fonte monoespaçada */
+        font-size: 0.9em;
+        line-height: 1.6;
+    }
+    h3 { color: #4CAF50; font-size: 1.05em; margin: 0.6cm 0 0.3cm; }
+    p.prep-time { color: #555; font-size: 0.9em; }
+    ul.ingredients, ol.steps { padding-left: 1.2em; margin: 0; }
+    ul.ingredients li, ol.steps li { margin-bottom: 0.2cm; }
+"""
+
+# Só os campos que aparecem no PDF
+PdfRecipe = namedtuple("PdfRecipe", "title category subcategory full_text prep_minutes ingredients steps")
+
+# Ganchos do processo do app (configure): importação registrada em heavy_import e métricas de tempo.
+# Nos processos do pool ficam os padrões: importação direta e sem métricas.
+_import_module = importlib.import_module
+_timer = lambda name: nullcontext()
+
+def configure(import_module=None, timer=None):
+    global _import_module, _timer
+    if import_module is not None:
+        _import_module = import_module
+    if timer is not None:
+        _timer = timer
+
+def pdf_recipe(recipe):
+    return PdfRecipe(recipe.title, recipe.category, recipe.subcategory, recipe.full_text,
+                     recipe.prep_minutes, list(recipe.ingredients), list(recipe.steps))
+
+def weasyprint_html(**kwargs):
+    return _import_module("weasyprint").HTML(**kwargs)
+
+def pdf_html_document(title, body_html):
+    return "".join([
+        '<!DOCTYPE html><html><head><meta charset="UTF-8"><title>', html.escape(title), "</title>",
+        "<style>", PDF_STYLE, "</style></head><body>", body_html, "</body></html>",
+    ])
+
+def recipe_pdf_fragment(recipe):
+    parts = [
+        '<div class="recipe"><h2>', html.escape(recipe.title), "</h2>",
+        '<p class="category-info"><i>Categoria: ', html.escape(recipe.category), " / ", html.escape(recipe.subcategory), "</i></p>",
+    ]
+    if not recipe.ingredients and not recipe.steps:
+        # Texto sem seções reconhecíveis: mantém o markdown como veio
+        parts += ["<pre>", html.escape(recipe.full_text), "</pre></div>"]
+        return "".join(parts)
+    # Campos já analisados na entrada: listas de verdade em vez do markdown cru
+    if recipe.prep_minutes is not None:
+        parts += ['<p class="prep-time">Tempo de preparo total: ', str(recipe.prep_minutes), " minutos</p>"]
+    if recipe.ingredients:
+        parts.append('<h3>Ingredientes</h3><ul class="ingredients">')
+        for quantity, name in recipe.ingredients:
+            parts += ["<li>", f"<b>{html.escape(quantity)}</b> " if quantity else "", html.escape(name), "</li>"]
+        parts.append("</ul>")
+    if recipe.steps:
+        parts.append('<h3>Modo de Preparo</h3><ol class="steps">')
+        parts += ["".join(["<li>", html.escape(step), "</li>"]) for step in recipe.steps]
+        parts.append("</ol>")
+    parts.append("</div>")
+    return "".join(parts)
+
+def recipe_content_digest(recipe):
+    # Identifica o conteúdo renderizado, não só o ID: uma receita regravada gera nova diagramação
+    content = "\x1f".join([PDF_LAYOUT_VERSION, recipe.title, recipe.category, recipe.subcategory, recipe.full_text])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class RenderedRecipeCache:
+    """LRU em memória das receitas já diagramadas pelo WeasyPrint (um Document por receita),
+    limitada em número de entradas e em bytes estimados."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._documents = OrderedDict() # digest -> (Document, bytes estimados)
+        self._lock = threading.Lock()
+        self.estimated_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict_locked()
+
+    def _evict_locked(self):
+        while self._documents and (len(self._documents) > self.max_entries or self.estimated_bytes > self.max_bytes):
+            _, (_, size) = self._documents.popitem(last=False)
+            self.estimated_bytes -= size
+
+    def get_document(self, recipe):
+        key = recipe_content_digest(recipe)
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # A diagramação (a parte cara) acontece fora do lock
+        with _timer("pdf_html_assembly"):
+            document_html = pdf_html_document(recipe.title, recipe_pdf_fragment(recipe))
+        with _timer("pdf_layout"):
+            document = weasyprint_html(string=document_html).render()
+        size = len(document_html) * PDF_LAYOUT_BYTES_PER_HTML_BYTE
+        if self.max_entries > 0 and size <= self.max_bytes:
+            with self._lock:
+                if key not in self._documents: # Outra thread pode ter diagramado a mesma receita ao mesmo tempo
+                    self._documents[key] = (document, size)
+                    self.estimated_bytes += size
+                    self._evict_locked()
+        return document
+
+rendered_recipe_cache = RenderedRecipeCache(PDF_FRAGMENT_CACHE_SIZE, PDF_LAYOUT_CACHE_MAX_BYTES)
+
+def init_render_process(layout_cache_max_bytes):
+    # Inicializador dos processos do pool: cada um fica com sua fração do orçamento do cache de diagramação
+    rendered_recipe_cache.resize(layout_cache_max_bytes)
+
+def render_cookbook_pdf(pdf_title, recipes, include_cover=True, target=None):
+    """Monta um trecho do livro juntando as páginas já diagramadas de cada receita (e da capa com o título).
+
+    Com `target` (arquivo aberto em modo binário) o PDF é escrito nele e nada é devolvido.
+    """
+    documents = [rendered_recipe_cache.get_document(recipe) for recipe in recipes]
+    if include_cover:
+        with _timer("pdf_layout"):
+            documents.insert(0, weasyprint_html(string=pdf_html_document(pdf_title, f"<h1>{html.escape(pdf_title)}</h1>")).render())
+    pages = [page for document in documents for page in document.pages]
+    with _timer("pdf_write"):
+        return documents[0].copy(pages).write_pdf(target)
+
+def render_pdf_chunk(pdf_title, recipes, include_cover, part_path):
+    # Executado nos processos do pool; o cache de diagramação de cada processo é reaproveitado entre jobs.
+    # A parte vai para um arquivo: só o caminho volta pelo pipe, não os bytes do PDF
+    with open(part_path, "wb") as f:
+        render_cookbook_pdf(pdf_title, recipes, include_cover=include_cover, target=f)
+    return part_path
+
+def merge_pdf_chunks(part_paths, target):
+    writer = _import_module("pypdf").PdfWriter()
+    for part_path in part_paths:
+        writer.append(part_path)
+    writer.write(target)
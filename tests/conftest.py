@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+
+# src.main lê a configuração no import: dados num diretório temporário e sem reabastecimento do pool
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="receitas-tests-"))
+os.environ.setdefault("RECIPE_POOL_SIZE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Validação dos corpos JSON das rotas de geração: erros sempre em JSON com status 400."""
+import pytest
+
+from src.main import app
+
+
+@pytest.fixture
+def client():
+    client = app.test_client()
+    client.post("/login", data={"username": "teste", "password": "teste"})
+    return client
+
+
+@pytest.mark.parametrize("path", ["/generate_recipe", "/generate_recipe/stream", "/generate_recipes/batch"])
+@pytest.mark.parametrize("body", [[1], "texto", 3, None, {}])
+def test_body_that_is_not_an_object_is_rejected(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch_item_that_is_not_an_object_fails_alone(client):
+    response = client.post("/generate_recipes/batch", json={"items": [[1]]})
+    assert response.status_code == 200
+    assert response.get_json()["results"] == [{"index": 0, "ok": False, "status": 400, "error": "Requisição sem dados JSON."}]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Análise do markdown das receitas: títulos, ingredientes e tokens usados nos filtros."""
+import pytest
+
+from src.main import RECIPE_UNTITLED, ingredient_tokens, normalize_ingredient_token, parse_ingredient, parse_recipe_text
+
+RECIPE_BODY = """
+**Tempo total:** 1h30
+
+## Ingredientes
+- 1 kg de lombo de porco
+- 2 xícaras de farinha de trigo
+- 3 dentes de alho picados
+- Sal a gosto
+
+## Modo de Preparo
+1. Tempere o lombo com o alho e o sal.
+2. Asse por 50 minutos.
+
+## Acompanhamento
+Sirva com arroz branco.
+"""
+
+
+@pytest.mark.parametrize("first_line, title", [
+    ("# Lombo de Porco Assado", "Lombo de Porco Assado"),
+    ("## Salada Nutritiva de Quinoa", "Salada Nutritiva de Quinoa"),
+    ("# Frango com Acompanhamento de Legumes", "Frango com Acompanhamento de Legumes"),
+    ("# Bolo Passo a Passo", "Bolo Passo a Passo"),
+    ("**Torta de Limão com Dicas da Vovó**", "Torta de Limão com Dicas da Vovó"),
+    ("Pão de Queijo Mineiro", "Pão de Queijo Mineiro"),
+])
+def test_title_keeps_section_words_inside_the_title(first_line, title):
+    assert parse_recipe_text(first_line + "\n" + RECIPE_BODY)["title"] == title
+
+
+def test_title_falls_back_to_second_line_after_placeholder():
+    assert parse_recipe_text("# Receita\n## Escondidinho de Carne Seca\n" + RECIPE_BODY)["title"] == "Escondidinho de Carne Seca"
+
+
+@pytest.mark.parametrize("first_line", ["## Ingredientes", "Modo de Preparo", "**Ingredientes:**"])
+def test_section_heading_is_not_a_title(first_line):
+    assert parse_recipe_text(first_line + "\n- 2 ovos\n")["title"] == RECIPE_UNTITLED
+
+
+def test_sections_ingredients_steps_and_time():
+    structure = parse_recipe_text("# Lombo de Porco Assado\n" + RECIPE_BODY)
+    assert structure["ingredients"] == [
+        ("1 kg", "lombo de porco"), ("2 xícaras", "farinha de trigo"), ("3 dentes", "alho picados"), ("a gosto", "Sal"),
+    ]
+    assert structure["steps"] == ["Tempere o lombo com o alho e o sal.", "Asse por 50 minutos."]
+    assert structure["prep_minutes"] == 90
+    assert structure["ingredient_tokens"] == ["alho", "farinha", "lombo", "porco", "sal", "trigo"]
+
+
+@pytest.mark.parametrize("line, parsed", [
+    ("2 xícaras de farinha de trigo", ("2 xícaras", "farinha de trigo")),
+    ("1/2 colher de sopa de sal", ("1/2 colher de sopa", "sal")),
+    ("3 ovos", ("3", "ovos")),
+    ("Sal e pimenta a gosto", ("a gosto", "Sal e pimenta")),
+    ("Farinha: 2 xícaras", ("2 xícaras", "Farinha")),
+    ("Cheiro-verde", (None, "Cheiro-verde")),
+])
+def test_parse_ingredient(line, parsed):
+    assert parse_ingredient(line) == parsed
+
+
+@pytest.mark.parametrize("plural, singular", [
+    ("ovos", "ovo"), ("paes", "pao"), ("limoes", "limao"), ("nozes", "noz"), ("colheres", "colher"),
+    ("pasteis", "pastel"), ("tomates", "tomate"), ("sal", "sal"), ("arroz", "arroz"),
+])
+def test_normalize_ingredient_token(plural, singular):
+    assert normalize_ingredient_token(plural) == singular
+
+
+def test_ingredient_tokens_match_singular_and_plural():
+    assert ingredient_tokens("nozes picadas") == ingredient_tokens("noz") == {"noz"}
+    assert ingredient_tokens("pães franceses") >= ingredient_tokens("pão")
+    assert ingredient_tokens("sal e mais pimenta") == {"sal", "pimenta"}